@@ -1,157 +1,7 @@
--- orders_table
-
--- Changing the columns datatype in oders_table
-ALTER TABLE orders_table
-ALTER COLUMN date_uuid TYPE UUID USING date_uuid::uuid,
-ALTER COLUMN user_uuid TYPE UUID USING user_uuid::uuid,
-ALTER COLUMN card_number TYPE VARCHAR(50),
-ALTER COLUMN store_code TYPE VARCHAR(50),
-ALTER COLUMN product_code TYPE VARCHAR(50),
-ALTER COLUMN product_quantity TYPE SMALLINT;
-
--- Getting the maximum length of the varchar to change the type
-SELECT MAX(CHAR_LENGTH(card_number)) FROM orders_table;
-SELECT MAX(CHAR_LENGTH(store_code)) FROM orders_table;
-SELECT MAX(CHAR_LENGTH(product_code)) FROM orders_table;
-
--- Changing the columns datatype according to max varchar
-ALTER TABLE orders_table
-ALTER COLUMN card_number TYPE VARCHAR(19),
-ALTER COLUMN store_code TYPE VARCHAR(12),
-ALTER COLUMN product_code TYPE VARCHAR(11);
-
--- dim_users
-
--- Changing the columns datatype in dim_users
-ALTER TABLE dim_users
-ALTER COLUMN first_name TYPE VARCHAR(255),
-ALTER COLUMN last_name TYPE VARCHAR(255),
-ALTER COLUMN date_of_birth TYPE DATE,
-ALTER COLUMN country_code TYPE VARCHAR(2),
-ALTER COLUMN user_uuid TYPE UUID USING user_uuid::uuid,
-ALTER COLUMN join_date TYPE DATE;
-
--- dim_store_details
-
--- Changing the columns datatype in dim_store_details
-ALTER TABLE dim_store_details
-ALTER COLUMN longitude TYPE FLOAT,
-ALTER COLUMN locality TYPE VARCHAR(255),
-ALTER COLUMN store_code TYPE VARCHAR(50),
-ALTER COLUMN staff_numbers TYPE SMALLINT,
-ALTER COLUMN opening_date TYPE DATE,
-ALTER COLUMN store_type TYPE VARCHAR(255),
-ALTER COLUMN latitude TYPE FLOAT,
-ALTER COLUMN country_code TYPE VARCHAR(2),
-ALTER COLUMN continent TYPE VARCHAR(255);
-
-
--- dim_products
-
--- Add weight_class column
-ALTER TABLE dim_products ADD COLUMN weight_class VARCHAR(14);
-UPDATE dim_products
-SET weight_class = CASE
-    WHEN weight_kg < 2 THEN 'Light'
-    WHEN weight_kg BETWEEN 3 AND 40 THEN 'Mid_Sized'
-    WHEN weight_kg BETWEEN 41 AND 140 THEN 'Heavy'
-    ELSE 'Truck_required'
-END;
-
--- Change Column name
-ALTER TABLE dim_products RENAME COLUMN removed TO still_available;
-
--- Change columns datatypes
-ALTER TABLE dim_products
-ALTER COLUMN price_£ TYPE FLOAT,
-ALTER COLUMN weight_kg TYPE FLOAT,
-ALTER COLUMN "EAN" TYPE VARCHAR(50),
-ALTER COLUMN product_code TYPE VARCHAR(50),
-ALTER COLUMN date_added TYPE DATE,
-ALTER COLUMN uuid TYPE UUID USING uuid::uuid,
-ALTER COLUMN still_available TYPE BOOL USING 
-	CASE 
-		WHEN still_available LIKE 'Still_available' THEN true
-		ELSE false
-	END;
-
-
--- dim_date_times
-
--- Change columns datatypes
-ALTER TABLE dim_date_times
-ALTER COLUMN month TYPE CHAR(2),
-ALTER COLUMN year TYPE CHAR(4),
-ALTER COLUMN day TYPE CHAR(2),
-ALTER COLUMN time_period TYPE VARCHAR(11),
-ALTER COLUMN date_uuid TYPE UUID USING date_uuid::uuid;
-
--- dim_card_details
-
--- Change columns datatypes
-ALTER TABLE dim_card_details
-ALTER COLUMN card_number TYPE VARCHAR(19),
-ALTER COLUMN expiry_date TYPE VARCHAR(5),
-ALTER COLUMN date_payment_confirmed TYPE DATE;
-
-
--- Make Primary keys
-ALTER TABLE dim_card_details
-ADD CONSTRAINT PK_dim_card_details_card_number PRIMARY KEY (card_number);
-
-ALTER TABLE dim_date_times
-ADD CONSTRAINT PK_dim_date_times_date_uuid PRIMARY KEY (date_uuid);
-
-ALTER TABLE dim_store_details
-ADD CONSTRAINT PK_dim_store_details_store_code PRIMARY KEY (store_code);
-
-ALTER TABLE dim_products
-ADD CONSTRAINT PK_dim_products_product_code PRIMARY KEY (product_code);
-
-ALTER TABLE dim_users
-ADD CONSTRAINT PK_dim_users_user_uuid PRIMARY KEY (user_uuid);
-
-
--- Make foreign keys
-INSERT INTO dim_store_details (store_code, staff_numbers, opening_date, country_code)
-VALUES ('WEB-1388012W', 325, '2010-06-12', 'WEB');
-
-ALTER TABLE orders_table
-ADD CONSTRAINT FK_orders_table_card_number
-FOREIGN KEY (card_number)
-REFERENCES dim_card_details(card_number);
-
-ALTER TABLE orders_table
-ADD CONSTRAINT FK_orders_table_date_uuid
-FOREIGN KEY (date_uuid)
-REFERENCES dim_date_times(date_uuid);
-
-INSERT INTO dim_store_details (store_code, staff_numbers, opening_date, store_type)
-VALUES ('WEB-1388012W', 325, '2010-06-12', 'Web Portal');
-
-DELETE FROM orders_table
-WHERE store_code NOT IN (SELECT store_code FROM dim_store_details);
-
-ALTER TABLE orders_table
-ADD CONSTRAINT FK_orders_table_store_code
-FOREIGN KEY (store_code)
-REFERENCES dim_store_details(store_code);
-
-DELETE FROM orders_table
-WHERE product_code NOT IN (SELECT product_code FROM dim_products);
-
-ALTER TABLE orders_table
-ADD CONSTRAINT FK_orders_table_product_code
-FOREIGN KEY (product_code)
-REFERENCES dim_products(product_code);
-
-DELETE FROM orders_table
-WHERE user_uuid NOT IN (SELECT user_uuid FROM dim_users);
-
-ALTER TABLE orders_table
-ADD CONSTRAINT FK_orders_table_user_uuid
-FOREIGN KEY (user_uuid)
-REFERENCES dim_users(user_uuid);
+-- The column types and primary keys are defined in star_schema.py and created when each table is loaded.
+-- The foreign keys are set by SQL_schema.sql, which the pipeline runs once every table has been loaded.
+-- The sales queries are also available from sales_metrics.py, which reads them from summary tables that
+-- are refreshed after each load.
 
 -- How many stores does the business have and in which countries?
 SELECT country_code AS country, COUNT(*) AS total_no_stores
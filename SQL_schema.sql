@@ -0,0 +1,29 @@
+-- The column types, primary keys and the weight_class column are created up front from star_schema.py
+-- when each table is loaded, and orders without a matching store, product or user are dropped before
+-- they are loaded, so only the foreign keys are left here.
+
+-- Make foreign keys
+ALTER TABLE orders_table
+ADD CONSTRAINT FK_orders_table_card_number
+FOREIGN KEY (card_number)
+REFERENCES dim_card_details(card_number);
+
+ALTER TABLE orders_table
+ADD CONSTRAINT FK_orders_table_date_uuid
+FOREIGN KEY (date_uuid)
+REFERENCES dim_date_times(date_uuid);
+
+ALTER TABLE orders_table
+ADD CONSTRAINT FK_orders_table_store_code
+FOREIGN KEY (store_code)
+REFERENCES dim_store_details(store_code);
+
+ALTER TABLE orders_table
+ADD CONSTRAINT FK_orders_table_product_code
+FOREIGN KEY (product_code)
+REFERENCES dim_products(product_code);
+
+ALTER TABLE orders_table
+ADD CONSTRAINT FK_orders_table_user_uuid
+FOREIGN KEY (user_uuid)
+REFERENCES dim_users(user_uuid);
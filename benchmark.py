@@ -0,0 +1,234 @@
+import argparse
+import json
+import time
+import tracemalloc
+from cleaning_plan import CleaningPlan
+from data_cleaning import DataCleaner
+from synthetic_data import SyntheticDataGenerator
+
+class BenchmarkHarness:
+    
+    def __init__(self, rows=10 ** 4, seed=0, repeat=3, measure_memory=True, clean_workers=1):
+        
+        '''It sets up a benchmark of the cleaners and the other pipeline stages on synthetic data, recording
+        the wall time and the peak traced memory of each stage
+        
+        Parameters
+        ----------
+        rows
+            the number of rows generated for each source
+        seed
+            the seed of the synthetic data generator
+        repeat
+            the number of timed runs of each stage, of which the fastest is kept
+        measure_memory
+            whether to make an extra run of each stage under tracemalloc to record its peak memory
+        clean_workers
+            the number of processes the users and orders are also cleaned in, to compare with a single
+            process, or 1 to skip the partitioned runs
+        '''
+        
+        self.rows = rows
+        self.seed = seed
+        self.repeat = repeat
+        self.measure_memory = measure_memory
+        self.clean_workers = clean_workers
+        self.results = {}
+    
+    
+    
+    def measure(self, name, function, make_input):
+        
+        '''This function runs one stage, giving it a fresh input each time so stages that change their input
+        in place are measured fairly, and records its fastest wall time and its peak memory
+        
+        Parameters
+        ----------
+        name
+            the name of the stage
+        function
+            the function that runs the stage on its input
+        make_input
+            a function with no arguments that returns a fresh input for the stage
+        
+        Returns
+        -------
+            The output of the last run, or None if the stage failed.
+        '''
+        
+        result = {'rows_in': None, 'rows_out': None, 'seconds': None, 'peak_bytes': None, 'error': None}
+        output = None
+        try:
+            times = []
+            for _ in range(self.repeat):
+                stage_input = make_input()
+                start = time.perf_counter()
+                output = function(stage_input)
+                times.append(time.perf_counter() - start)
+            result['rows_in'] = len(stage_input)
+            result['rows_out'] = len(output[0] if isinstance(output, tuple) else output) if output is not None else None
+            result['seconds'] = min(times)
+            
+            if self.measure_memory:
+                stage_input = make_input()
+                tracemalloc.start()
+                function(stage_input)
+                result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        except Exception as error:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            result['error'] = f'{type(error).__name__}: {str(error).splitlines()[0] if str(error) else ""}'
+            output = None
+        
+        self.results[name] = result
+        
+        return output
+    
+    
+    
+    def run_cleaners(self):
+        
+        '''This function generates every source and benchmarks its generation, its cleaner and the stages
+        inside the cleaners that are worth following on their own
+        
+        Returns
+        -------
+            A dictionary of the results of each stage.
+        '''
+        
+        generator = SyntheticDataGenerator(self.seed)
+        cleaner = DataCleaner()
+        sources = {}
+        for source in ['users', 'cards', 'stores', 'products', 'date_times']:
+            start = time.perf_counter()
+            sources[source] = getattr(generator, source)(self.rows)
+            self.results[f'generate_{source}'] = {'rows_in': None, 'rows_out': self.rows, 'seconds': time.perf_counter() - start,
+                                                  'peak_bytes': None, 'error': None}
+        sources['orders'] = generator.orders(self.rows, sources['users'], sources['stores'], sources['products'])
+        
+        cleaners = {'users': cleaner.clean_user_data, 'cards': cleaner.clean_card_data, 'stores': cleaner.clean_store_data,
+                    'products': cleaner.clean_products_data, 'orders': cleaner.clean_orders_data,
+                    'date_times': cleaner.clean_date_times_data}
+        cleaned = {}
+        for source, clean_function in cleaners.items():
+            cleaned[source] = self.measure(f'clean_{source}', clean_function, lambda source=source: sources[source].copy())
+        if self.clean_workers > 1:
+            with DataCleaner(max_workers=self.clean_workers) as partitioned_cleaner:
+                for source, method in [('users', 'clean_user_data'), ('orders', 'clean_orders_data')]:
+                    self.measure(f'clean_{source}_partitioned', lambda df, method=method: partitioned_cleaner.clean_in_partitions(method, df),
+                                 lambda source=source: sources[source].copy())
+        
+        self.measure('plan_drop_nulls', CleaningPlan().drop_nulls().execute, lambda: sources['users'].copy())
+        self.measure('convert_product_weights', cleaner.convert_product_weights, lambda: sources['products']['weight'].copy())
+        if all(cleaned[source] is not None for source in ['users', 'stores', 'products', 'orders']):
+            key_sets = {'user_uuid': cleaned['users']['user_uuid'], 'store_code': cleaned['stores']['store_code'],
+                        'product_code': cleaned['products']['product_code']}
+            self.measure('filter_orphans', lambda df: cleaner.filter_orphans(df, key_sets), lambda: cleaned['orders'].copy())
+        
+        return self.results
+    
+    
+    
+    def run_uploads(self, db_connector, table_name='benchmark_orders'):
+        
+        '''This function benchmarks loading the synthetic orders into the local database with COPY and with
+        pandas' INSERTs, replacing a scratch table that is dropped afterwards
+        
+        Parameters
+        ----------
+        db_connector
+            the database connector object
+        table_name
+            the name of the scratch table
+        
+        Returns
+        -------
+            A dictionary of the results of each stage.
+        '''
+        
+        orders = DataCleaner().clean_orders_data(SyntheticDataGenerator(self.seed).orders(self.rows))
+        for method in ['copy', 'to_sql']:
+            self.measure(f'upload_{method}', lambda df, method=method: db_connector.upload_to_db(df, table_name, method=method) or df,
+                         lambda: orders)
+        with db_connector.init_local_db_engine().begin() as connection:
+            connection.exec_driver_sql(f'DROP TABLE IF EXISTS "{table_name}"')
+        
+        return self.results
+    
+    
+    
+    def compare(self, baseline, tolerance=0.25):
+        
+        '''This function compares the results with a stored baseline and lists the stages that got slower or
+        used more memory by more than the tolerance, or that now fail
+        
+        Parameters
+        ----------
+        baseline
+            the results of an earlier run
+        tolerance
+            the allowed relative increase, 0.25 for 25%
+        
+        Returns
+        -------
+            A list of messages, one for each regression.
+        '''
+        
+        regressions = []
+        for name, result in self.results.items():
+            previous = baseline.get(name)
+            if previous is None:
+                continue
+            if result['error'] and not previous.get('error'):
+                regressions.append(f'{name} now fails: {result["error"]}')
+                continue
+            for metric in ['seconds', 'peak_bytes']:
+                if result.get(metric) and previous.get(metric) and result[metric] > previous[metric] * (1 + tolerance):
+                    regressions.append(f'{name} {metric}: {previous[metric]:.6g} -> {result[metric]:.6g}')
+        
+        return regressions
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the cleaners and pipeline stages on synthetic data.')
+    parser.add_argument('--rows', type=int, default=10 ** 4, help='the number of rows generated for each source')
+    parser.add_argument('--seed', type=int, default=0, help='the seed of the synthetic data')
+    parser.add_argument('--repeat', type=int, default=3, help='the number of timed runs of each stage')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run of each stage')
+    parser.add_argument('--clean-workers', type=int, default=1, help='also clean the users and orders split between this many processes')
+    parser.add_argument('--uploads', action='store_true', help='also benchmark COPY against INSERT uploads to the local database')
+    parser.add_argument('--baseline', help='a JSON file of earlier results to compare with')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='the allowed relative slowdown before a stage counts as a regression')
+    args = parser.parse_args()
+    
+    harness = BenchmarkHarness(args.rows, args.seed, args.repeat, not args.no_memory, args.clean_workers)
+    harness.run_cleaners()
+    if args.uploads:
+        from database_utils import DatabaseConnector
+        with DatabaseConnector() as dbcon:
+            harness.run_uploads(dbcon)
+    
+    for name, result in harness.results.items():
+        if result['error']:
+            print(f'{name:28} failed: {result["error"]}')
+        else:
+            peak = f'{result["peak_bytes"] / 2 ** 20:9.1f} MiB' if result['peak_bytes'] is not None else ''
+            print(f'{name:28} {result["seconds"]:9.4f}s {peak}')
+    
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'rows': args.rows, 'seed': args.seed, 'results': harness.results}, file, indent=4)
+    
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        if baseline.get('rows') != args.rows:
+            print(f'warning: the baseline was recorded with {baseline.get("rows")} rows')
+        regressions = harness.compare(baseline['results'], args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            raise SystemExit(1)
@@ -0,0 +1,350 @@
+import time
+import numpy as np
+import pandas as pd
+from instrumentation import INSTRUMENTATION, instrumented
+
+class PlanStep:
+    
+    def __init__(self, kind, function, reads=None, writes=(), rowwise=True, label=None):
+        
+        '''It describes one operation of a cleaning plan
+        
+        Parameters
+        ----------
+        kind
+            'filter' for an operation that returns a boolean mask of the rows to keep, or 'transform' for one
+            that returns the changed dataframe
+        function
+            the function that runs the operation, called with the dataframe
+        reads
+            the columns a filter looks at, or None when it looks at every column
+        writes
+            the columns a transform changes, or None when it can change any column
+        rowwise
+            whether the result for each row depends only on that row, so rows dropped earlier or later give
+            the same result for the rows that are kept
+        label
+            a short name for the step, such as the filter and the column it looks at, used to record what
+            each filter removed when instrumentation is enabled
+        '''
+        
+        self.kind = kind
+        self.function = function
+        self.reads = None if reads is None else frozenset(reads)
+        self.writes = None if writes is None else frozenset(writes)
+        self.rowwise = rowwise
+        self.label = label
+    
+    
+    
+    def can_run_before(self, step):
+        
+        '''This function checks whether this filter can be moved in front of an earlier transform, which is
+        the case when the transform works row by row and does not change any column the filter looks at
+        
+        Parameters
+        ----------
+        step
+            the earlier transform
+        
+        Returns
+        -------
+            True when the two steps can swap places without changing the result.
+        '''
+        
+        if step.kind != 'transform' or not step.rowwise or step.writes is None:
+            return False
+        if not step.writes:
+            return True
+        
+        return self.reads is not None and not (self.reads & step.writes)
+
+
+
+class CleaningPlan:
+    
+    def __init__(self):
+        
+        '''It sets up an empty cleaning plan. Operations are recorded by chaining the methods of the plan and
+        nothing runs until execute is called, at which point the row filters are moved as early as they can
+        go and every run of consecutive filters is combined into one mask and applied with a single take'''
+        
+        self.steps = []
+    
+    
+    
+    def add(self, step):
+        
+        '''This function records a step and returns the plan so that calls can be chained'''
+        
+        self.steps.append(step)
+        
+        return self
+    
+    
+    
+    def drop_nulls(self, null_value='NULL'):
+        
+        '''This function records a filter dropping every row with a missing value or the null_value string in
+        any column. The kept rows of an object column that held the string have their dtype inferred again,
+        as DataFrame.replace followed by dropna would
+        
+        Parameters
+        ----------
+        null_value
+            the string the sources use for a missing value
+        '''
+        
+        found_columns = set()
+        
+        def mask(df):
+            found_columns.clear()
+            keep = np.ones(len(df), dtype=bool)
+            for column in df.columns:
+                values = df[column]
+                keep &= values.notna().to_numpy()
+                if values.dtype == object or isinstance(values.dtype, (pd.StringDtype, pd.CategoricalDtype)):
+                    found = values.eq(null_value).to_numpy(dtype=bool, na_value=False)
+                    if found.any():
+                        keep &= ~found
+                        found_columns.add(column)
+            return keep
+        
+        def infer(df):
+            for column in found_columns:
+                if column in df.columns and df[column].dtype == object:
+                    df[column] = df[column].infer_objects()
+            return df
+        
+        self.add(PlanStep('filter', mask, label='drop_nulls'))
+        
+        return self.add(PlanStep('transform', infer, writes=()))
+    
+    
+    
+    def reject(self, column, pattern):
+        
+        '''This function records a filter dropping the rows where a column matches a regular expression
+        
+        Parameters
+        ----------
+        column
+            the column to search
+        pattern
+            the regular expression to search for
+        '''
+        
+        def mask(df):
+            values = df[column]
+            if values.dtype != object and not isinstance(values.dtype, pd.StringDtype):
+                values = values.astype('string')
+            return ~values.str.contains(pattern, na=False).to_numpy(dtype=bool)
+        
+        return self.add(PlanStep('filter', mask, reads=[column], label=f'reject {column}'))
+    
+    
+    
+    def keep(self, column, predicate):
+        
+        '''This function records a filter keeping the rows where a predicate of a column is True
+        
+        Parameters
+        ----------
+        column
+            the column the predicate looks at
+        predicate
+            a function taking the column and returning a boolean series or array
+        '''
+        
+        def mask(df):
+            keep = predicate(df[column])
+            if isinstance(keep, pd.Series):
+                return keep.to_numpy(dtype=bool, na_value=False)
+            return np.asarray(keep, dtype=bool)
+        
+        return self.add(PlanStep('filter', mask, reads=[column], label=f'keep {column}'))
+    
+    
+    
+    def assign(self, column, function, rowwise=True):
+        
+        '''This function records a transform setting a column to the result of a function of the dataframe
+        
+        Parameters
+        ----------
+        column
+            the column to set
+        function
+            a function taking the dataframe and returning the new values of the column
+        rowwise
+            whether the function works row by row
+        '''
+        
+        def transform(df):
+            df[column] = function(df)
+            return df
+        
+        return self.add(PlanStep('transform', transform, writes=[column], rowwise=rowwise))
+    
+    
+    
+    def replace(self, column, pattern, replacement, regex=False):
+        
+        '''This function records a transform replacing a pattern in the strings of a column'''
+        
+        return self.assign(column, lambda df: df[column].str.replace(pattern, replacement, regex=regex))
+    
+    
+    
+    def replace_values(self, column, replacements):
+        
+        '''This function records a transform applying a dictionary of regular expression replacements to a
+        column in a single pass'''
+        
+        return self.assign(column, lambda df: df[column].replace(replacements, regex=True))
+    
+    
+    
+    def to_datetime(self, column, parser=None):
+        
+        '''This function records a transform converting a column to datetimes with a DateParser, which parses
+        each string on its own. Without a parser pd.to_datetime infers the format from the first value, so
+        the transform is then not treated as working row by row'''
+        
+        if parser is not None:
+            return self.assign(column, lambda df: parser.parse(df[column]))
+        
+        return self.assign(column, lambda df: pd.to_datetime(df[column]), rowwise=False)
+    
+    
+    
+    def cast(self, column, dtype):
+        
+        '''This function records a transform converting a column to a dtype. Categories depend on the values
+        present, so a cast to category is not treated as working row by row'''
+        
+        return self.assign(column, lambda df: df[column].astype(dtype), rowwise=dtype != 'category')
+    
+    
+    
+    def drop_columns(self, *columns):
+        
+        '''This function records a transform dropping columns'''
+        
+        return self.add(PlanStep('transform', lambda df: df.drop(list(columns), axis=1), writes=columns))
+    
+    
+    
+    def rename(self, columns):
+        
+        '''This function records a transform renaming columns with a dictionary of old to new names'''
+        
+        writes = [*columns.keys(), *columns.values()]
+        
+        return self.add(PlanStep('transform', lambda df: df.rename(columns=columns), writes=writes))
+    
+    
+    
+    def move(self, column, position):
+        
+        '''This function records a transform moving a column to a position'''
+        
+        def transform(df):
+            values = df.pop(column)
+            df.insert(position, column, values)
+            return df
+        
+        return self.add(PlanStep('transform', transform))
+    
+    
+    
+    def reset_index(self):
+        
+        '''This function records a transform numbering the rows from 0'''
+        
+        return self.add(PlanStep('transform', lambda df: df.reset_index(drop=True), writes=None, rowwise=False))
+    
+    
+    
+    def optimise(self):
+        
+        '''This function orders the steps of the plan for execution, moving each filter in front of the
+        earlier transforms it does not depend on so that the transforms run on fewer rows and neighbouring
+        filters can share one take. Filters keep their order among themselves
+        
+        Returns
+        -------
+            The list of steps in the order they run.
+        '''
+        
+        ordered = []
+        for step in self.steps:
+            position = len(ordered)
+            if step.kind == 'filter':
+                while position > 0 and step.can_run_before(ordered[position - 1]):
+                    position -= 1
+            ordered.insert(position, step)
+        
+        return ordered
+    
+    
+    
+    def apply_filter(self, step, df, keep):
+        
+        '''This function narrows the combined mask of a run of filters with one filter and, while
+        instrumentation is enabled, records a plan_filter event with the label of the filter and the rows it
+        removed from the rows the earlier filters of the run kept
+        
+        Parameters
+        ----------
+        step
+            the filter
+        df
+            the dataframe the run of filters is evaluated on
+        keep
+            the combined mask of the earlier filters of the run, narrowed in place
+        '''
+        
+        if not INSTRUMENTATION.enabled:
+            keep &= step.function(df)
+            return
+        
+        rows_in = int(np.count_nonzero(keep))
+        start = time.perf_counter()
+        keep &= step.function(df)
+        wall_time = time.perf_counter() - start
+        INSTRUMENTATION.record('plan_filter', step.label, wall_time, rows_in, None, int(np.count_nonzero(keep)), None)
+    
+    
+    
+    @instrumented('cleaning_plan')
+    def execute(self, df):
+        
+        '''This function runs the plan on a dataframe. Each run of consecutive filters is evaluated on the same
+        rows, so a filter has to accept the values an earlier filter of the run would have dropped
+        
+        Parameters
+        ----------
+        df
+            the dataframe to clean
+        
+        Returns
+        -------
+            The cleaned dataframe.
+        '''
+        
+        steps = self.optimise()
+        position = 0
+        while position < len(steps):
+            if steps[position].kind == 'filter':
+                keep = np.ones(len(df), dtype=bool)
+                while position < len(steps) and steps[position].kind == 'filter':
+                    self.apply_filter(steps[position], df, keep)
+                    position += 1
+                if not keep.all():
+                    df = df.take(np.flatnonzero(keep))
+            else:
+                df = steps[position].function(df)
+                position += 1
+        
+        return df
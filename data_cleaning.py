@@ -1,9 +1,271 @@
-import re
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
+from cleaning_plan import CleaningPlan
+from date_parser import DateParser
+from instrumentation import instrumented
+
+WEIGHT_PATTERN = r'^\s*(?:(?P<multiplier>\d+(?:\.\d+)?)\s*x\s*)?(?P<quantity>\d+(?:\.\d+)?|\.\d+)\s*(?P<unit>kg|g|ml|oz)\b'
+WEIGHT_UNIT_FACTORS = {'kg': 1, 'g': 0.001, 'ml': 0.001, 'oz': 0.0283495}
+
+# Card numbers are kept as strings of at most 19 digits, the width of the dim_card_details key, once any
+# leading question marks are removed.
+CARD_NUMBER_WIDTH = 19
+CARD_NUMBER_PREFIX = r'^\?+'
+CARD_NUMBER_PATTERN = r'\d{1,19}'
+
+# Text columns are stored as Arrow-backed strings when pyarrow is installed, which take a fraction of
+# the memory of Python string objects.
+try:
+    import pyarrow as pa
+    STRING_DTYPE = 'string[pyarrow]'
+except ImportError:
+    pa = None
+    STRING_DTYPE = 'string'
+
+# The dtypes each cleaner gives its output: strings for free text and keys, categories for codes with
+# few distinct values, and 'integer', 'unsigned' or 'float' for numbers downcast to the smallest type
+# that holds them.
+USER_DTYPES = {'first_name': STRING_DTYPE, 'last_name': STRING_DTYPE, 'company': STRING_DTYPE, 'email_address': STRING_DTYPE,
+               'address': STRING_DTYPE, 'country': 'category', 'country_code': 'category', 'phone_number': STRING_DTYPE,
+               'user_uuid': STRING_DTYPE}
+CARD_DTYPES = {'card_number': STRING_DTYPE, 'expiry_date': STRING_DTYPE, 'card_provider': 'category'}
+STORE_DTYPES = {'address': STRING_DTYPE, 'locality': STRING_DTYPE, 'store_code': STRING_DTYPE, 'staff_numbers': 'integer',
+                'store_type': 'category', 'country_code': 'category', 'continent': 'category'}
+PRODUCT_DTYPES = {'product_name': STRING_DTYPE, 'category': 'category', 'EAN': STRING_DTYPE, 'uuid': STRING_DTYPE,
+                  'removed': 'category', 'product_code': STRING_DTYPE}
+ORDER_DTYPES = {'date_uuid': STRING_DTYPE, 'user_uuid': STRING_DTYPE, 'card_number': STRING_DTYPE,
+                'store_code': 'category', 'product_code': 'category', 'product_quantity': 'integer'}
+DATE_TIME_DTYPES = {'timestamp': STRING_DTYPE, 'month': 'unsigned', 'year': 'unsigned', 'day': 'unsigned',
+                    'time_period': 'category', 'date_uuid': STRING_DTYPE}
+CLEANER_DTYPES = {'clean_user_data': USER_DTYPES, 'clean_card_data': CARD_DTYPES, 'clean_store_data': STORE_DTYPES,
+                  'clean_products_data': PRODUCT_DTYPES, 'clean_orders_data': ORDER_DTYPES,
+                  'clean_date_times_data': DATE_TIME_DTYPES}
+
+# Frames smaller than this many rows per worker are cleaned in the calling process, where starting the
+# work in other processes would cost more than it saves.
+MIN_PARTITION_ROWS = 5000
+
+# The cleaner of each worker process, created once so its date cache is kept between partitions.
+WORKER_CLEANER = None
+
+def frame_to_ipc(df):
+    
+    '''It packs a dataframe for sending to or from a worker process, as an Arrow IPC stream when pyarrow can
+    convert every column, which is copied as one block of bytes instead of being pickled object by object.
+    A RangeIndex travels as metadata, so it comes back as a RangeIndex
+    
+    Parameters
+    ----------
+    df
+        the dataframe to send
+    
+    Returns
+    -------
+        A tuple of the format, 'arrow' or 'pickle', and the packed dataframe.
+    '''
+    
+    if pa is not None:
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=None)
+        except pa.ArrowException:
+            return 'pickle', df
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return 'arrow', sink.getvalue()
+    
+    return 'pickle', df
+
+
+
+def frame_from_ipc(packed):
+    
+    '''It unpacks a dataframe packed by frame_to_ipc'''
+    
+    packing, payload = packed
+    if packing == 'arrow':
+        return pa.ipc.open_stream(payload).read_all().to_pandas()
+    
+    return payload
+
+
+
+def init_partition_worker(date_formats, date_cache):
+    
+    '''It creates the cleaner a worker process cleans its partitions with, starting from the dates the
+    parent process had already parsed'''
+    
+    global WORKER_CLEANER
+    WORKER_CLEANER = DataCleaner(date_parser=DateParser(date_formats))
+    WORKER_CLEANER.date_parser.cache = date_cache
+
+
+
+def clean_partition(method, packed, kwargs):
+    
+    '''It cleans one partition of a dataframe in a worker process
+    
+    Parameters
+    ----------
+    method
+        the name of the DataCleaner method to clean the partition with
+    packed
+        the partition, packed by frame_to_ipc
+    kwargs
+        the keyword arguments of the method
+    
+    Returns
+    -------
+        A tuple of the packed cleaned partition, the number of unparseable dates in each column, the number
+        of unparseable weights and a dictionary of the dates parsed for the partition, to be merged into the
+        cache of the parent process.
+    '''
+    
+    date_parser = WORKER_CLEANER.date_parser
+    date_parser.unparseable = {}
+    WORKER_CLEANER.unparseable_weights = 0
+    known_dates = len(date_parser.cache)
+    clean_df = getattr(WORKER_CLEANER, method)(frame_from_ipc(packed), **kwargs)
+    new_dates = dict(itertools.islice(date_parser.cache.items(), known_dates, None))
+    
+    return frame_to_ipc(clean_df), date_parser.unparseable, WORKER_CLEANER.unparseable_weights, new_dates
 
 class DataCleaner:
     
+    def __init__(self, date_parser=None, max_workers=1):
+        
+        '''It sets up a cleaner of the source dataframes
+        
+        Parameters
+        ----------
+        date_parser
+            the DateParser used for every date column, whose cache is shared by all the cleaning methods; a
+            new one is created when it is not given
+        max_workers
+            the number of worker processes clean_in_partitions splits a dataframe between, or 1 to clean
+            every dataframe in the calling process
+        '''
+        
+        self.date_parser = date_parser if date_parser is not None else DateParser()
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor = None
+        self.executor_lock = threading.Lock()
+        self.unparseable_weights = 0
+        self.counts_lock = threading.Lock()
+    
+    
+    
+    def __enter__(self):
+        
+        return self
+    
+    
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        
+        self.close()
+    
+    
+    
+    def close(self):
+        
+        '''This function shuts down the worker processes, if any were started'''
+        
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+    
+    
+    
+    def clean_in_partitions(self, method, df, **kwargs):
+        
+        '''It cleans a dataframe with one of the cleaning methods, splitting its rows into one partition for
+        each worker process and cleaning the partitions at the same time. The partitions travel to and from
+        the workers as Arrow IPC streams, and the result is the same as cleaning the whole dataframe at once.
+        The workers start from the dates already in the cache of the date parser, and the dates they parse
+        are merged back into it, so they are saved with the rest of the cache
+        
+        Parameters
+        ----------
+        method
+            the name of the cleaning method, such as 'clean_user_data'
+        df
+            the dataframe to clean
+        kwargs
+            the keyword arguments of the cleaning method
+        
+        Returns
+        -------
+            The cleaned dataframe.
+        '''
+        
+        partitions = min(self.max_workers, len(df) // MIN_PARTITION_ROWS)
+        if partitions < 2:
+            return getattr(self, method)(df, **kwargs)
+        
+        with self.executor_lock:
+            if self.executor is None:
+                with self.date_parser.lock:
+                    date_cache = dict(self.date_parser.cache)
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                                    initializer=init_partition_worker, initargs=(self.date_parser.formats, date_cache))
+            executor = self.executor
+        
+        bounds = np.linspace(0, len(df), partitions + 1).astype(int)
+        futures = [executor.submit(clean_partition, method, frame_to_ipc(df.iloc[start:end]), kwargs)
+                   for start, end in zip(bounds[:-1], bounds[1:])]
+        frames = []
+        for future in futures:
+            packed, unparseable, unparseable_weights, new_dates = future.result()
+            frames.append(frame_from_ipc(packed))
+            with self.date_parser.lock:
+                self.date_parser.cache.update(new_dates)
+                for column, count in unparseable.items():
+                    self.date_parser.unparseable[column] = self.date_parser.unparseable.get(column, 0) + count
+            with self.counts_lock:
+                self.unparseable_weights += unparseable_weights
+        
+        return self.concat_partitions(method, frames)
+    
+    
+    
+    def concat_partitions(self, method, frames):
+        
+        '''It joins the cleaned partitions of a dataframe back together in order. The rows are numbered from 0
+        again when the cleaner numbers them, category columns get the union of the categories of the
+        partitions, and the dtype policy of the cleaner is applied again so the downcast numbers match a
+        single run
+        
+        Parameters
+        ----------
+        method
+            the name of the cleaning method the partitions were cleaned with
+        frames
+            the cleaned partitions, in order
+        
+        Returns
+        -------
+            The cleaned dataframe.
+        '''
+        
+        renumber = all(frame.index.equals(pd.RangeIndex(len(frame))) for frame in frames)
+        df = pd.concat(frames, ignore_index=renumber)
+        for column in df.columns:
+            if isinstance(frames[0][column].dtype, pd.CategoricalDtype) and not isinstance(df[column].dtype, pd.CategoricalDtype):
+                categories = pd.api.types.union_categoricals([frame[column] for frame in frames], sort_categories=True)
+                df[column] = pd.Categorical(categories, dtype=pd.CategoricalDtype(categories.categories))
+        
+        return self.apply_dtype_policy(df, CLEANER_DTYPES.get(method, {}))
+    
+    
+    
+    @instrumented('replace_and_drop_null')
     def replace_and_drop_null(self, df):
         
         '''It takes a dataframe as an argument, replaces the string 'NULL' with a null value, and then drops
@@ -26,6 +288,7 @@ class DataCleaner:
     
     
     
+    @instrumented('drop_rows_containing_mask', describe=lambda self, df, column, exp: column)
     def drop_rows_containing_mask(self, df, column, exp):
         
         '''It takes a dataframe, a column name, and a regular expression, and returns a dataframe with the rows
@@ -45,14 +308,66 @@ class DataCleaner:
             A dataframe with the rows containing the mask dropped. 
         '''
         
-        mask = df[column].str.contains(exp)
-        rows_to_drop = mask.index[mask].tolist()    
-        df.drop(rows_to_drop, inplace=True)
+        mask = df[column].str.contains(exp, na=False).astype(bool)
+        
+        return self.filter_rows(df, ~mask)
+    
+    
+    
+    def filter_rows(self, df, keep):
+        
+        '''It returns the rows of a dataframe where keep is True, taking them by position so the result is a
+        frame of its own rather than a slice that later column assignments would have to copy again
+        
+        Parameters
+        ----------
+        df
+            the dataframe to filter
+        keep
+            a boolean series or array with one value for each row
+        
+        Returns
+        -------
+            A dataframe with only the rows to keep.
+        '''
+        
+        return df.take(np.flatnonzero(np.asarray(keep, dtype=bool)))
+    
+    
+    
+    def apply_dtype_policy(self, df, policy):
+        
+        '''It converts the columns of a cleaned dataframe to the compact dtypes of a policy, such as
+        Arrow-backed strings, categories and downcast numbers
+        
+        Parameters
+        ----------
+        df
+            the cleaned dataframe
+        policy
+            a dictionary of the dtype of each column, where 'integer', 'unsigned' and 'float' downcast the
+            column to the smallest numeric type that holds it, and categories no row uses are dropped
+        
+        Returns
+        -------
+            The dataframe with its columns converted.
+        '''
+        
+        for column, dtype in policy.items():
+            if column not in df.columns:
+                continue
+            if dtype in ('integer', 'unsigned', 'float'):
+                df[column] = pd.to_numeric(df[column], downcast=dtype)
+            elif dtype == 'category':
+                df[column] = df[column].astype(dtype).cat.remove_unused_categories()
+            else:
+                df[column] = df[column].astype(dtype)
         
         return df
     
     
     
+    @instrumented('clean_user_data')
     def clean_user_data(self, user_df):
         
         '''It replaces null values with the string 'unknown', drops rows containing digits in the first name
@@ -72,55 +387,93 @@ class DataCleaner:
             A dataframe with cleaned data.
         '''
 
-        user_df = self.replace_and_drop_null(user_df)
-        user_df = self.drop_rows_containing_mask(user_df, "first_name", "\d+")
-        user_df['date_of_birth'] = pd.to_datetime(user_df['date_of_birth'])
-        user_df['email_address'] = user_df['email_address'].str.replace('@@', '@')
-        user_df['country_code'] = user_df['country_code'].str.replace('GG', 'G')
-        user_df['country_code'] = user_df['country_code'].astype('category')
         replacements = {'\(0\)': '', '[\)\(\.\- ]' : '', '^\+': '00'}
-        user_df['phone_number'] = user_df['phone_number'].replace(replacements, regex=True)
-        user_df = self.drop_rows_containing_mask(user_df, "phone_number", "[a-zA-Z]")
-        user_df['join_date'] = pd.to_datetime(user_df['join_date'])
-        user_df['phone_number'] = user_df['phone_number'].str.replace('^00\d{2}', '', regex=True)
         code_dict = {'GB': '0044', 'US': '001', 'DE': '0049'}
-        user_df['phone_number'] = user_df['phone_number'].apply(lambda x: code_dict.get(user_df.loc[user_df['phone_number']==x, 'country_code'].values[0], '') + x)
-        user_df = user_df.reset_index(drop=True)
-        
-        return user_df        
+        plan = (CleaningPlan()
+                .drop_nulls()
+                .reject('first_name', '\d+')
+                .to_datetime('date_of_birth', self.date_parser)
+                .replace('email_address', '@@', '@')
+                .replace('country_code', 'GG', 'G')
+                .cast('country_code', 'category')
+                .replace_values('phone_number', replacements)
+                .reject('phone_number', '[a-zA-Z]')
+                .to_datetime('join_date', self.date_parser)
+                .replace('phone_number', '^00\d{2}', '', regex=True)
+                .assign('phone_number', lambda df: df['country_code'].astype('object').map(code_dict).fillna('') + df['phone_number'])
+                .reset_index())
+        user_df = plan.execute(user_df)
+        
+        return self.apply_dtype_policy(user_df, USER_DTYPES)        
     
     
     
-    def clean_card_data(self, card_df):
+    @instrumented('clean_card_data')
+    def clean_card_data(self, card_df, check_luhn=False):
         
-        '''It takes a dataframe of credit card data, replaces null values with 'Unknown', drops null values,
-        removes leading question marks from card numbers, removes non-numeric card numbers, converts the
-        date column to a datetime object, converts the card number column to an integer, and converts the
-        card provider column to a category
+        '''It takes a dataframe of credit card data, drops null values, converts the card numbers to strings,
+        removes leading question marks from them, drops the card numbers that are not 1 to 19 digits long,
+        converts the date column to a datetime object, and converts the card provider column to a category.
+        Card numbers stay strings so that leading zeros are kept and 19 digit numbers fit the VARCHAR(19) key
+        of dim_card_details
         
         Parameters
         ----------
         card_df
             the dataframe of card data
+        check_luhn
+            whether to add a luhn_valid column flagging the card numbers that pass the Luhn checksum
         
         Returns
         -------
             A dataframe with the cleaned data.
         '''
-
-        card_df = self.replace_and_drop_null(card_df)
-        card_df.dropna(inplace=True)
-        card_df['card_number'] = card_df['card_number'].apply(lambda x: re.sub(r'^\?+', '', x) if isinstance(x, str) else x)
-        card_df = card_df[card_df['card_number'].apply(lambda x: str(x).isdigit())]
-        card_df['date_payment_confirmed'] = pd.to_datetime(card_df['date_payment_confirmed'])
-        card_df['card_number'] = card_df['card_number'].astype('int')
-        card_df['card_provider'] = card_df['card_provider'].astype('category')        
-        card_df = card_df.reset_index(drop=True)
-        
-        return card_df
-
-
-
+        
+        plan = (CleaningPlan()
+                .drop_nulls()
+                .cast('card_number', STRING_DTYPE)
+                .replace('card_number', CARD_NUMBER_PREFIX, '', regex=True)
+                .keep('card_number', lambda card_numbers: card_numbers.str.fullmatch(CARD_NUMBER_PATTERN))
+                .to_datetime('date_payment_confirmed', self.date_parser)
+                .reset_index())
+        if check_luhn:
+            plan.assign('luhn_valid', lambda df: self.luhn_valid(df['card_number']))
+        card_df = plan.execute(card_df)
+        
+        return self.apply_dtype_policy(card_df, CARD_DTYPES)
+    
+    
+    
+    def luhn_valid(self, card_numbers):
+        
+        '''It checks a column of card numbers against the Luhn checksum, working on all of them at once as a
+        matrix of digits. The numbers are padded with leading zeros to 19 digits, which leaves the checksum
+        unchanged
+        
+        Parameters
+        ----------
+        card_numbers
+            a column of card numbers written as 1 to 19 digits
+        
+        Returns
+        -------
+            A boolean array that is True for the card numbers that pass the check.
+        '''
+        
+        padded = card_numbers.astype(str).str.zfill(CARD_NUMBER_WIDTH)
+        if not len(padded):
+            return np.zeros(0, dtype=bool)
+        digits = np.frombuffer(''.join(padded).encode('ascii'), dtype=np.uint8).reshape(-1, CARD_NUMBER_WIDTH) - ord('0')
+        digits = digits.astype(np.int16)
+        doubled = (CARD_NUMBER_WIDTH - 1 - np.arange(CARD_NUMBER_WIDTH)) % 2 == 1
+        digits[:, doubled] *= 2
+        digits[digits > 9] -= 9
+        
+        return digits.sum(axis=1) % 10 == 0
+    
+    
+    
+    @instrumented('clean_store_data')
     def clean_store_data(self, store_df):
         
         '''The above function cleans the store data. It drops the lat column, replaces the NULL values with
@@ -140,67 +493,66 @@ class DataCleaner:
             A dataframe with the cleaned data.
         '''
         
-        store_df.drop('lat', axis=1, inplace=True)
-        store_df = self.replace_and_drop_null(store_df)
-        store_df = self.drop_rows_containing_mask(store_df, "staff_numbers", "[a-zA-Z]")
-        store_df['continent'] = store_df['continent'].str.replace('ee', '')
-        store_df['opening_date'] = pd.to_datetime(store_df['opening_date'])
-        column_to_move = store_df.pop('latitude')
-        store_df.insert(2, 'latitude', column_to_move)
-        store_df['longitude'] = store_df['longitude'].astype('float')
-        store_df['latitude'] = store_df['latitude'].astype('float')
-        store_df['staff_numbers'] = store_df['staff_numbers'].astype('int')
-        store_df['store_type'] = store_df['store_type'].astype('category')
-        store_df['country_code'] = store_df['country_code'].astype('category')
-        store_df = store_df.reset_index(drop=True)
-        
-        return store_df
+        plan = (CleaningPlan()
+                .drop_columns('lat')
+                .drop_nulls()
+                .reject('staff_numbers', '[a-zA-Z]')
+                .replace('continent', 'ee', '')
+                .to_datetime('opening_date', self.date_parser)
+                .move('latitude', 2)
+                .cast('longitude', 'float')
+                .cast('latitude', 'float')
+                .cast('staff_numbers', 'int')
+                .reset_index())
+        store_df = plan.execute(store_df)
+        
+        return self.apply_dtype_policy(store_df, STORE_DTYPES)
     
         
-    def convert_product_weights(self, weight):
+    @instrumented('convert_product_weights')
+    def convert_product_weights(self, weights):
         
-        '''It takes a string as an input, and if it finds a certain pattern, it will convert the string into a
-        float
+        '''It takes a column of weights written as strings such as '1.6kg', '500 g', '330ml', '16oz' or
+        '12 x 100g', pulls the multiplier, quantity and unit out of each distinct value with a single
+        regular expression and converts the whole column to kilograms. Values that do not match the pattern become NaN so they can
+        be dropped, and are counted in unparseable_weights so the products dropped for them can be reported.
         
         Parameters
         ----------
-        weight
-            the weight of the product
+        weights
+            the column of product weights
         
         Returns
         -------
-            the weight of the product in kg.
+            A column with the weight of each product in kg.
         '''
         
-        weight = str(weight)
-        if re.search(r'kg\b', weight):
-            x = re.sub("[\s,'kg']", "", weight)
-            return float(x)
-        elif re.search ('x', weight):
-            weight = re.sub("x", "*", weight)
-            y = re.sub("[\s,'g']", "", weight)
-            z = eval(y)
-            return float(z)/1000
-        elif re.search (r'ml\b',weight):
-            x = re.sub("[\s,'ml']", "", weight)
-            return float(x)/1000
-        elif re.search(r'g\b', weight):
-            x = re.sub("[\s,'g']", "", weight)
-            return float(x)/1000
-        elif re.search(r'oz\b', weight):
-            x = re.sub("[\s,'oz']", "", weight)
-            return float(x)*0.0283495
-        
-        return weight
+        codes, uniques = pd.factorize(weights)
+        parts = pd.Series(uniques, dtype='string').str.lower().str.extract(WEIGHT_PATTERN)
+        multiplier = pd.to_numeric(parts['multiplier'], errors='coerce').fillna(1)
+        quantity = pd.to_numeric(parts['quantity'], errors='coerce')
+        factor = parts['unit'].map(WEIGHT_UNIT_FACTORS).astype('float')
+        unique_kg = np.append((multiplier * quantity * factor).to_numpy(dtype='float'), np.nan)
+        kg = unique_kg[codes]
+        failed = int(np.count_nonzero(np.isnan(kg) & (codes != -1)))
+        if failed:
+            with self.counts_lock:
+                self.unparseable_weights += failed
+        
+        return pd.Series(kg, index=weights.index, name=weights.name)
+    
+    
     
+    @instrumented('clean_products_data')
     def clean_products_data(self, product_df):
         
         '''It takes a dataframe of products, replaces all instances of 'NULL' with NaN, drops all rows with
         NaN, drops all rows with non-numeric characters in the product_price column, drops all rows with EAN
         codes longer than 13 characters, converts the date_added column to datetime, converts the weight
-        column to float, removes the £ symbol from the product_price column, converts the product_price
-        column to float, converts the category and removed columns to category, renames the weight and
-        product_price columns to weight_kg and price_£, drops the Unnamed: 0 column, and resets the index
+        column to kg, drops rows whose weight cannot be parsed, removes the £ symbol from the product_price
+        column, converts the product_price column to float, converts the category and removed columns to
+        category, renames the weight and product_price columns to weight_kg and price_£, drops the
+        Unnamed: 0 column, and resets the index
         
         Parameters
         ----------
@@ -212,24 +564,25 @@ class DataCleaner:
             A dataframe with the cleaned products data.
         '''
         
-        product_df = self.replace_and_drop_null(product_df)
-        product_df = self.drop_rows_containing_mask(product_df, "product_price", "[a-zA-Z]")
-        product_df = product_df[product_df['EAN'].str.len() <= 13]
-        product_df['date_added'] = pd.to_datetime(product_df['date_added'])
-        product_df['weight'] = product_df['weight'].apply(self.convert_product_weights)
-        product_df['weight'] = product_df['weight'].astype('float')
-        product_df['product_price'] = product_df['product_price'].str.replace('£', '')
-        product_df['product_price'] = product_df['product_price'].astype('float')
-        product_df['category'] = product_df['category'].astype('category')
-        product_df['removed'] = product_df['removed'].astype('category')
-        product_df.rename(columns={'weight': 'weight_kg', 'product_price': 'price_£'}, inplace=True)
-        product_df.drop('Unnamed: 0', axis=1, inplace=True)
-        product_df = product_df.reset_index(drop=True)
+        plan = (CleaningPlan()
+                .drop_nulls()
+                .reject('product_price', '[a-zA-Z]')
+                .keep('EAN', lambda eans: eans.str.len() <= 13)
+                .to_datetime('date_added', self.date_parser)
+                .assign('weight', lambda df: self.convert_product_weights(df['weight']))
+                .keep('weight', lambda weights: weights.notna())
+                .replace('product_price', '£', '')
+                .cast('product_price', 'float')
+                .rename({'weight': 'weight_kg', 'product_price': 'price_£'})
+                .drop_columns('Unnamed: 0')
+                .reset_index())
+        product_df = plan.execute(product_df)
         
-        return product_df
+        return self.apply_dtype_policy(product_df, PRODUCT_DTYPES)
         
         
         
+    @instrumented('clean_orders_data')
     def clean_orders_data(self, order_df):
         
         '''It drops the first_name, last_name, and 1 columns from the order_df dataframe.
@@ -244,18 +597,23 @@ class DataCleaner:
             A dataframe with the columns first_name, last_name, and 1 dropped.
         '''
         
-        order_df.drop(['first_name', 'last_name', '1'], axis=1, inplace=True)
+        order_df = CleaningPlan().drop_columns('first_name', 'last_name', '1').execute(order_df)
         
-        return order_df
+        return self.apply_dtype_policy(order_df, ORDER_DTYPES)
     
     
     
+    @instrumented('clean_date_times_data')
     def clean_date_times_data(self, date_times_df):
         
         '''This function takes in a dataframe and returns a dataframe with the following changes:
         
-        1. Replaces null values with the string "unknown"
-        2. Drops rows containing the string "month"
+        1. Drops rows with null values or the string "NULL"
+        2. Drops rows containing letters in the month column
+        
+        The month, year and day columns may be strings or, when they were decoded into integers as the JSON
+        was read, nullable integers whose junk values are already missing, in which case the first step drops
+        them.
         
         Parameters
         ----------
@@ -267,7 +625,39 @@ class DataCleaner:
             A dataframe with the cleaned data.
         '''
         
-        date_times_df = self.replace_and_drop_null(date_times_df)
-        date_times_df = self.drop_rows_containing_mask(date_times_df, "month", "[a-zA-Z]")  
+        plan = CleaningPlan().drop_nulls()
+        if not pd.api.types.is_numeric_dtype(date_times_df['month']):
+            plan.reject('month', '[a-zA-Z]')
+        date_times_df = plan.execute(date_times_df)
+        
+        return self.apply_dtype_policy(date_times_df, DATE_TIME_DTYPES)
+    
+    
+    
+    @instrumented('filter_orphans')
+    def filter_orphans(self, df, key_sets):
+        
+        '''It keeps only the rows whose foreign keys are all found in their dimension tables, checking each
+        key column against a set of valid keys with a single vectorized lookup
+        
+        Parameters
+        ----------
+        df
+            the dataframe to filter, such as the cleaned orders
+        key_sets
+            a dictionary of the valid keys for each foreign key column, such as the store codes of the
+            cleaned store details
+        
+        Returns
+        -------
+            A tuple of the filtered dataframe and a dictionary of the number of orphaned rows for each key.
+        '''
+        
+        keep = np.ones(len(df), dtype=bool)
+        orphan_counts = {}
+        for column, keys in key_sets.items():
+            found = df[column].isin(keys).to_numpy()
+            orphan_counts[column] = int((~found).sum())
+            keep &= found
         
-        return date_times_df            
\ No newline at end of file
+        return self.filter_rows(df, keep), orphan_counts
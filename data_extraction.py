@@ -1,10 +1,187 @@
+import multiprocessing
+import os
+import tempfile
 import boto3
+import ijson
 import requests
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import tabula
+import numpy as np
+from pypdf import PdfReader
+from sqlalchemy import text
 import pandas as pd
+from data_cleaning import STRING_DTYPE
+from instrumentation import INSTRUMENTATION, CountingReader, instrumented
+
+PRODUCTS_DTYPES = {'product_name': STRING_DTYPE, 'product_price': STRING_DTYPE, 'weight': STRING_DTYPE, 'category': 'category',
+                   'EAN': STRING_DTYPE, 'date_added': STRING_DTYPE, 'uuid': STRING_DTYPE, 'removed': 'category',
+                   'product_code': STRING_DTYPE}
+
+# The dtypes the columns of date_details.json are decoded into while it is streamed.
+DATE_DETAILS_DTYPES = {'timestamp': 'string', 'month': 'UInt8', 'year': 'UInt16', 'day': 'UInt8', 'time_period': 'category',
+                       'date_uuid': 'string'}
+
+# The largest value of each unsigned integer dtype a column can be decoded into.
+UNSIGNED_LIMITS = {'UInt8': 2 ** 8 - 1, 'UInt16': 2 ** 16 - 1, 'UInt32': 2 ** 32 - 1}
+
+# The number of values of a JSON column gathered before they are decoded into a typed array.
+JSON_CHUNK_SIZE = 65536
+
+def decode_column(values, dtype):
+    
+    '''It converts a list of values of a JSON column to an array of a compact dtype. Values that do not fit
+    an unsigned integer dtype, such as 'NULL' or junk text, become missing values
+    
+    Parameters
+    ----------
+    values
+        the list of values
+    dtype
+        'UInt8', 'UInt16', 'UInt32', 'category' or 'string', which is stored in Arrow when pyarrow is installed
+    
+    Returns
+    -------
+        A pandas array of the values.
+    '''
+    
+    if dtype in UNSIGNED_LIMITS:
+        numbers = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype='float64')
+        valid = (numbers >= 0) & (numbers <= UNSIGNED_LIMITS[dtype]) & (numbers == np.floor(numbers))
+        return pd.arrays.IntegerArray(np.where(valid, numbers, 0).astype(dtype.lower()), ~valid)
+    if dtype == 'category':
+        return pd.Categorical(values)
+    
+    return pd.array([None if value is None else str(value) for value in values], dtype=STRING_DTYPE)
+
+
+
+def read_json_columns(stream, dtypes, chunk_size=JSON_CHUNK_SIZE):
+    
+    '''It reads a column-oriented JSON object, such as {"month": {"0": "9", "1": "2"}, ...}, from a binary
+    stream one parsing event at a time, decoding the values of each column into typed arrays a chunk at a
+    time, so neither the text nor a dictionary of the document is ever held in memory
+    
+    Parameters
+    ----------
+    stream
+        the binary file-like object to read from
+    dtypes
+        a dictionary of the dtype of each column, as taken by decode_column; other columns are read as strings
+    chunk_size
+        the number of values gathered before they are decoded
+    
+    Returns
+    -------
+        A dataframe indexed by the keys of the first column.
+    '''
+    
+    columns = {}
+    index_keys = None
+    depth = 0
+    for event, value in ijson.basic_parse(stream):
+        if event == 'map_key':
+            if depth == 1:
+                column, dtype = value, dtypes.get(value, 'string')
+                keys, values, chunks = [], [], []
+            else:
+                keys.append(value)
+        elif event == 'start_map':
+            depth += 1
+        elif event == 'end_map':
+            depth -= 1
+            if depth == 1:
+                chunks.append(decode_column(values, dtype))
+                if dtype == 'category':
+                    decoded = pd.api.types.union_categoricals(chunks, sort_categories=True)
+                else:
+                    decoded = pd.concat([pd.Series(chunk) for chunk in chunks], ignore_index=True).array
+                if index_keys is None:
+                    index_keys = keys
+                elif keys != index_keys:
+                    decoded = pd.Series(decoded, index=keys).reindex(index_keys).array
+                columns[column] = decoded
+        else:
+            values.append(value)
+            if len(values) == chunk_size:
+                chunks.append(decode_column(values, dtype))
+                values = []
+    
+    return pd.DataFrame(columns, index=pd.Index(index_keys or [], dtype=STRING_DTYPE))
+
+
+
+def read_pdf_pages(path, pages):
+    
+    '''It reads the tables on a range of pages of a local PDF file, in a worker process
+    
+    Parameters
+    ----------
+    path
+        the path to the pdf file
+    pages
+        the range of pages to read, such as '1-25'
+    
+    Returns
+    -------
+        A list of dataframes, one for each table found.
+    '''
+    
+    return tabula.read_pdf(path, pages=pages)
+
+
 
 class DataExtractor:
     
+    def __init__(self, cache=None, s3_client=None):
+        
+        '''It sets up the extractor, optionally with a SourceCache that keeps parsed copies of the PDF, S3
+        and JSON sources between runs
+        
+        Parameters
+        ----------
+        cache
+            the SourceCache to use, or None to always download and parse the sources
+        s3_client
+            the boto3 S3 client used to read s3:// addresses, created when first needed
+        '''
+        
+        self.cache = cache
+        self.s3_client = s3_client
+    
+    
+    
+    def load_source(self, source, loader, variant='', refresh=False):
+        
+        '''This function returns the dataframe of a source through the cache when there is one, and
+        otherwise calls the loader directly
+        
+        Parameters
+        ----------
+        source
+            the address of the source
+        loader
+            a function with no arguments that downloads and parses the source into a dataframe
+        variant
+            a string describing how the source is parsed
+        refresh
+            whether to ignore any cached copy of the source
+        
+        Returns
+        -------
+            A dataframe
+        '''
+        
+        if self.cache is None:
+            return loader()
+        
+        return self.cache.get_or_create(source, loader, variant, refresh)
+    
+    
+    
+    @instrumented('read_rds_table', describe=lambda self, db_connector, table_name, *args, **kwargs: table_name)
     def read_rds_table(self, db_connector, table_name):
         
         '''This function reads a table from a database and returns a pandas dataframe
@@ -28,31 +205,123 @@ class DataExtractor:
     
     
     
-    def retrieve_pdf_data(self, link):
+    @instrumented('stream_rds_table', describe=lambda self, db_connector, table_name, *args, **kwargs: table_name)
+    def stream_rds_table(self, db_connector, table_name, chunksize=50000, watermark=None):
+        
+        '''This function reads a table from a database through a server-side cursor and yields it as a
+        series of pandas dataframes, so only one chunk of the table is held in memory at a time. When a
+        watermark is given only the rows whose index is above it are read, in index order.
+        
+        Parameters
+        ----------
+        db_connector
+            the database connector object
+        table_name
+            The name of the table you want to read from.
+        chunksize
+            the number of rows in each dataframe
+        watermark
+            the highest index already extracted, or None to read the whole table
+        
+        Returns
+        -------
+            A generator of dataframes
+        '''
+        
+        engine = db_connector.init_db_engine()
+        with engine.connect().execution_options(stream_results=True, max_row_buffer=chunksize) as connection:
+            if watermark is None:
+                chunks = pd.read_sql_table(table_name, con=connection, index_col='index', chunksize=chunksize)
+            else:
+                query = text(f'SELECT * FROM "{table_name}" WHERE "index" > :watermark ORDER BY "index"')
+                chunks = pd.read_sql_query(query, con=connection, index_col='index', params={'watermark': int(watermark)}, chunksize=chunksize)
+            for df in chunks:
+                yield df
+    
+    
+    
+    def download_file(self, link, directory):
+        
+        '''This function downloads a file to a directory in blocks, without holding it in memory, and returns
+        the local path. Links that are already local paths are returned unchanged.
+        
+        Parameters
+        ----------
+        link
+            the link to the file
+        directory
+            the directory to save the file in
+        
+        Returns
+        -------
+            The path of the local file.
+        '''
+        
+        if not link.startswith(('http://', 'https://')):
+            return link
+        
+        path = os.path.join(directory, os.path.basename(urlparse(link).path) or 'download')
+        with requests.get(link, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with open(path, 'wb') as file:
+                for block in response.iter_content(chunk_size=1024 * 1024):
+                    INSTRUMENTATION.count_network_bytes(len(block))
+                    file.write(block)
+        
+        return path
+    
+    
+    
+    @instrumented('retrieve_pdf_data', describe=lambda self, link, *args, **kwargs: link)
+    def retrieve_pdf_data(self, link, refresh=False, max_workers=None):
         
         '''This function takes a link to a PDF file and returns a pandas dataframe of the data in the PDF
-        file
+        file. The file is downloaded once, split into one range of pages per worker and the ranges are
+        parsed in a pool of spawned processes, so the workers do not inherit the locks and connections of
+        the pipeline's threads, then the tables are joined back together in page order. A ValueError is
+        raised if the file has no tables.
         
         Parameters
         ----------
         link
             the link to the pdf file
+        refresh
+            whether to ignore any cached copy of the file
+        max_workers
+            the number of processes parsing the file, defaults to the number of CPUs
         
         Returns
         -------
             A dataframe
         '''
         
-        df = pd.concat(tabula.read_pdf(link, pages='all'), ignore_index=True)
+        def load_pdf():
+            with tempfile.TemporaryDirectory() as directory:
+                path = self.download_file(link, directory)
+                number_of_pages = len(PdfReader(path).pages)
+                workers = min(max_workers or os.cpu_count() or 1, number_of_pages)
+                tables = []
+                if workers:
+                    bounds = np.linspace(0, number_of_pages, workers + 1).astype(int)
+                    page_ranges = [f'{start + 1}-{end}' for start, end in zip(bounds[:-1], bounds[1:])]
+                    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+                        tables = [table for tables in executor.map(read_pdf_pages, [path] * workers, page_ranges) for table in tables]
+            if not tables:
+                raise ValueError(f'No tables found in {link}')
+            columns = tables[0].columns
+            tables = [table.set_axis(columns, axis=1) if len(table.columns) == len(columns) else table for table in tables]
+            return pd.concat(tables, ignore_index=True)
+        
+        df = self.load_source(link, load_pdf, 'pdf', refresh)
         
         return df
     
     
     
-    def list_number_of_stores(self, num_stores_endpoint, header_dict):
+    def list_number_of_stores(self, num_stores_endpoint, header_dict, session=None, timeout=30):
         
         '''This function takes in a URL and a dictionary of headers, and returns the number of stores in the
-        database.
+        database. The request goes through a session that retries 429 and 5xx responses.
         
         Parameters
         ----------
@@ -60,13 +329,23 @@ class DataExtractor:
             The endpoint for the number of stores.
         header_dict
             a dictionary of the headers that will be sent with the request
+        session
+            the session to send the request with, or None to create one with create_session
+        timeout
+            the number of seconds to wait for the response
         
         Returns
         -------
             The number of stores in the database.
         '''
         
-        response = requests.get(num_stores_endpoint, headers=header_dict)
+        if session is None:
+            with self.create_session(header_dict) as session:
+                return self.list_number_of_stores(num_stores_endpoint, header_dict, session, timeout)
+        
+        response = session.get(num_stores_endpoint, timeout=timeout)
+        response.raise_for_status()
+        INSTRUMENTATION.count_network_bytes(len(response.content))
         data = response.json()
         number_of_stores = data['number_stores']
         
@@ -74,10 +353,45 @@ class DataExtractor:
     
     
     
-    def retrieve_stores_data(self, num_stores_endpoint, stores_endpoint, header_dict):
+    def create_session(self, header_dict, retries=5, backoff_factor=0.5, pool_size=10):
+        
+        '''This function creates a requests session that keeps its connections alive and retries requests that
+        fail with a 429 or a 5xx status code, waiting longer between each attempt.
+        
+        Parameters
+        ----------
+        header_dict
+            a dictionary of the headers that will be sent with every request
+        retries
+            the maximum number of times a failed request is retried
+        backoff_factor
+            the factor used to work out the wait between retries
+        pool_size
+            the number of connections kept open to each host
+        
+        Returns
+        -------
+            A session object.
+        '''
+        
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=['GET'], respect_retry_after_header=True)
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
+        session = requests.Session()
+        session.headers.update(header_dict)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        
+        return session
+    
+    
+    
+    @instrumented('retrieve_stores_data')
+    def retrieve_stores_data(self, num_stores_endpoint, stores_endpoint, header_dict, max_workers=10, retries=5, backoff_factor=0.5, timeout=30):
         
         '''This function takes in the number of stores endpoint, the stores endpoint, and the header
-        dictionary, and returns a dataframe of all the stores data.
+        dictionary, and returns a dataframe of all the stores data. The stores are fetched concurrently in
+        a bounded thread pool that shares one keep-alive session.
         
         Parameters
         ----------
@@ -87,74 +401,145 @@ class DataExtractor:
             the endpoint for the stores data
         header_dict
             a dictionary of the headers that are required to access the API
+        max_workers
+            the maximum number of requests in flight at the same time
+        retries
+            the maximum number of times a request failing with a 429 or 5xx status code is retried
+        backoff_factor
+            the factor used to work out the wait between retries
+        timeout
+            the number of seconds to wait for each response
         
         Returns
         -------
             A dataframe with all the stores data.
         '''
         
-        number_of_stores = self.list_number_of_stores(num_stores_endpoint, header_dict)
-        
-        for store_number in range(number_of_stores):
+        stages = INSTRUMENTATION.current_stages()
+        with self.create_session(header_dict, retries, backoff_factor, max_workers) as session:
+            number_of_stores = self.list_number_of_stores(num_stores_endpoint, header_dict, session, timeout)
             
-            if store_number == 0:
-                response = requests.get(f'{stores_endpoint}/{store_number}', headers=header_dict)
-                data = response.json()
-                columns = list(data.keys())
-                df = pd.DataFrame(data, columns=columns, index=[0])
-                df.set_index("index", inplace=True)
-                dfs = []
-                dfs.append(df)
-            else:
-                response = requests.get(f'{stores_endpoint}/{store_number}', headers=header_dict)
-                data = response.json()                
-                df = pd.DataFrame(data, index=[0])
-                df.set_index("index", inplace=True)
-                dfs.append(df)
+            def fetch_store(store_number):
+                response = session.get(f'{stores_endpoint}/{store_number}', timeout=timeout)
+                response.raise_for_status()
+                INSTRUMENTATION.count_network_bytes(len(response.content), stages)
+                return response.json()
+            
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                records = list(executor.map(fetch_store, range(number_of_stores)))
         
-        df = pd.concat(dfs, ignore_index=True)
+        df = pd.DataFrame.from_records(records)
+        df.drop('index', axis=1, inplace=True, errors='ignore')
         
         return df
     
     
     
-    def extract_from_s3(self, address):
+    @instrumented('stream_from_s3', describe=lambda self, address, *args, **kwargs: address)
+    def stream_from_s3(self, address, dtype=None, usecols=None, chunksize=100000):
         
-        '''This function takes in a string that is the address of a csv file in an S3 bucket, and returns a
-        pandas dataframe of the csv file
+        '''This function reads a csv file in an S3 bucket through the boto3 streaming body and yields it as a
+        series of pandas dataframes, so the file is never downloaded or held in memory as a whole. Addresses
+        that are not s3:// addresses, such as https links and local paths, are read in chunks by pandas
+        
+        Parameters
+        ----------
+        address
+            the s3:// address, link or path of the file you want to extract
+        dtype
+            a dictionary of the type of each column, such as PRODUCTS_DTYPES
+        usecols
+            the columns you want to read, or None to read all of them
+        chunksize
+            the number of rows in each dataframe
+        
+        Returns
+        -------
+            A generator of dataframes
+        '''
+        
+        parsed = urlparse(address)
+        if parsed.scheme != 's3':
+            yield from pd.read_csv(address, dtype=dtype, usecols=usecols, chunksize=chunksize)
+            return
+        
+        if self.s3_client is None:
+            self.s3_client = boto3.client('s3')
+        body = self.s3_client.get_object(Bucket=parsed.netloc, Key=parsed.path.lstrip('/'))['Body']
+        
+        try:
+            for df in pd.read_csv(CountingReader(body), dtype=dtype, usecols=usecols, chunksize=chunksize):
+                yield df
+        finally:
+            body.close()
+    
+    
+    
+    @instrumented('extract_from_s3', describe=lambda self, address, *args, **kwargs: address)
+    def extract_from_s3(self, address, refresh=False, dtype=None, usecols=None):
+        
+        '''This function takes in a string that is the address of a csv file in an S3 bucket, or a link or
+        local path of one, and returns a pandas dataframe of the csv file
         
         Parameters
         ----------
         address
             the address of the file you want to extract
+        refresh
+            whether to ignore any cached copy of the file
+        dtype
+            a dictionary of the type of each column, such as PRODUCTS_DTYPES
+        usecols
+            the columns you want to read, or None to read all of them
         
         Returns
         -------
             A dataframe
         '''
         
-        client = boto3.client('s3')
-        df = pd.read_csv(address)
+        def load_csv():
+            df = pd.concat(self.stream_from_s3(address, dtype, usecols), ignore_index=True)
+            categories = [column for column, column_type in (dtype or {}).items() if column_type == 'category' and column in df]
+            return df.astype({column: 'category' for column in categories})
+        
+        df = self.load_source(address, load_csv, f'csv {dtype} {usecols}', refresh)
         
         return df
     
-    def extract_json_data(self, link):
+    @instrumented('extract_json_data', describe=lambda self, link, *args, **kwargs: link)
+    def extract_json_data(self, link, refresh=False, dtypes=DATE_DETAILS_DTYPES, timeout=30):
         
-        '''It takes a link as an input, makes a request to that link, and returns a dataframe of the json data.
+        '''It takes a link to a column-oriented JSON file, or the path of a local copy, streams it and returns
+        a dataframe of its columns decoded into compact dtypes, without loading the whole file first.
         
         Parameters
         ----------
         link
-            the link to the API
+            the link to the file, or a local file path
+        refresh
+            whether to ignore any cached copy of the data
+        dtypes
+            a dictionary of the dtype each column is decoded into
+        timeout
+            the number of seconds to wait for the server to respond
         
         Returns
         -------
             A dataframe
         '''
         
-        response = requests.get(link)
-        data = response.json()
-        df = pd.DataFrame.from_dict(data)
+        def load_json():
+            if urlparse(link).scheme not in ('http', 'https'):
+                with open(link, 'rb') as file:
+                    return read_json_columns(file, dtypes)
+            with self.create_session({}) as session:
+                with session.get(link, stream=True, timeout=timeout) as response:
+                    response.raise_for_status()
+                    response.raw.decode_content = True
+                    return read_json_columns(CountingReader(response.raw), dtypes)
+        
+        variant = 'json:' + ','.join(f'{column}={dtype}' for column, dtype in sorted(dtypes.items()))
+        df = self.load_source(link, load_json, variant, refresh)
         
         return df
         
\ No newline at end of file
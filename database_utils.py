@@ -1,9 +1,51 @@
+import io
+import threading
 import yaml
+import pandas as pd
+from sqlalchemy import MetaData
 from sqlalchemy import create_engine
 from sqlalchemy import inspect
+from sqlalchemy import text
+from star_schema import STAR_SCHEMA, conform_to_schema
+from instrumentation import instrumented
 
 class DatabaseConnector:
     
+    def __init__(self, pool_size=5, max_overflow=10, pool_pre_ping=True):
+        
+        '''It sets up the connector with an empty cache of engines, so each credentials file gets one
+        pooled engine that is reused for the rest of the run
+        
+        Parameters
+        ----------
+        pool_size
+            the number of connections each engine keeps open
+        max_overflow
+            the number of extra connections each engine may open when the pool is busy
+        pool_pre_ping
+            whether connections are checked before they are handed out from the pool
+        '''
+        
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_pre_ping = pool_pre_ping
+        self.engines = {}
+        self.engines_lock = threading.Lock()
+    
+    
+    
+    def __enter__(self):
+        
+        return self
+    
+    
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        
+        self.dispose()
+    
+    
+    
     def read_db_credentials(self, file):
         
         '''It reads a YAML file and returns a dictionary
@@ -25,28 +67,77 @@ class DatabaseConnector:
     
     
     
+    def get_engine(self, creds_file, prefix=''):
+        
+        '''This function returns the pooled engine for a credentials file, reading the file and creating the
+        engine the first time it is asked for
+        
+        Parameters
+        ----------
+        creds_file
+            The path to the YAML file containing the database credentials.
+        prefix
+            the prefix of the keys in the credentials file, for example 'RDS_'
+        
+        Returns
+        -------
+            An engine object.
+        '''
+        
+        with self.engines_lock:
+            if creds_file not in self.engines:
+                creds_dict = self.read_db_credentials(creds_file)
+                database_type = 'postgresql'
+                dbapi = 'psycopg2'
+                host = creds_dict[f'{prefix}HOST']
+                user = creds_dict[f'{prefix}USER']
+                password = creds_dict[f'{prefix}PASSWORD']
+                database = creds_dict[f'{prefix}DATABASE']
+                port = creds_dict.get(f'{prefix}PORT', 5432)
+                self.engines[creds_file] = create_engine(f'{database_type}+{dbapi}://{user}:{password}@{host}:{port}/{database}',
+                                                         pool_size=self.pool_size, max_overflow=self.max_overflow,
+                                                         pool_pre_ping=self.pool_pre_ping)
+        
+        return self.engines[creds_file]
+    
+    
+    
     def init_db_engine(self):
         
-        '''This function reads the database credentials from a yaml file, and then uses those credentials to
-        create a database engine
+        '''This function returns the engine for the source RDS database, whose credentials are in
+        db_creds.yaml
         
         Returns
         -------
             An engine object.
         '''
         
-        creds_dict = self.read_db_credentials('db_creds.yaml')
-        database_type = 'postgresql'
-        dbapi = 'psycopg2'
-        host = creds_dict['RDS_HOST']
-        user = creds_dict['RDS_USER']
-        password = creds_dict['RDS_PASSWORD']
-        database = creds_dict['RDS_DATABASE']
-        port = creds_dict['RDS_PORT']
-        engine = create_engine(f'{database_type}+{dbapi}://{user}:{password}@{host}:{port}/{database}')
-        engine.connect()
+        return self.get_engine('db_creds.yaml', prefix='RDS_')
+    
+    
+    
+    def init_local_db_engine(self):
+        
+        '''This function returns the engine for the local database the cleaned data is uploaded to, whose
+        credentials are in local_db_creds.yaml
         
-        return engine
+        Returns
+        -------
+            An engine object.
+        '''
+        
+        return self.get_engine('local_db_creds.yaml')
+    
+    
+    
+    def dispose(self):
+        
+        '''This function closes every connection held by the cached engines and empties the cache'''
+        
+        with self.engines_lock:
+            for engine in self.engines.values():
+                engine.dispose()
+            self.engines.clear()
     
     
     
@@ -66,10 +157,121 @@ class DatabaseConnector:
 
 
 
-    def upload_to_db(self, df, table_name):
+    @instrumented('run_sql_file', describe=lambda self, file: file)
+    def run_sql_file(self, file):
+        
+        '''This function runs every statement of a SQL file against the local database in a single
+        transaction, so the file is either applied completely or not at all
+        
+        Parameters
+        ----------
+        file
+            The path to the SQL file.
+        '''
+        
+        with open(file, 'r') as sql_file:
+            lines = [line for line in sql_file if not line.lstrip().startswith('--')]
+        statements = [statement.strip() for statement in ''.join(lines).split(';') if statement.strip()]
+        
+        engine = self.init_local_db_engine()
+        with engine.begin() as connection:
+            for statement in statements:
+                connection.exec_driver_sql(statement)
+    
+    
+    
+    def read_key_set(self, table_name, column):
         
-        '''This function takes a dataframe and a table name as arguments, reads the database credentials from a
-        yaml file, creates an engine, and uploads the dataframe to the database.
+        '''This function returns the distinct values of a key column of a table in the local database
+        
+        Parameters
+        ----------
+        table_name
+            the name of the table
+        column
+            the name of the key column
+        
+        Returns
+        -------
+            An index of the distinct keys, as strings.
+        '''
+        
+        engine = self.init_local_db_engine()
+        with engine.connect() as connection:
+            keys = connection.execute(text(f'SELECT DISTINCT "{column}"::text FROM "{table_name}"')).scalars().all()
+        
+        return pd.Index(keys)
+    
+    
+    
+    def copy_dataframe(self, connection, df, table_name, batch_size=100000, index=True):
+        
+        '''This function streams a dataframe into an existing table with PostgreSQL's COPY FROM STDIN,
+        writing it to an in-memory CSV buffer one batch of rows at a time.
+        
+        Parameters
+        ----------
+        connection
+            an open connection to the database
+        df
+            the dataframe you want to copy
+        table_name
+            the name of the table you want to copy the rows into
+        batch_size
+            the number of rows written to the buffer and sent to the database at a time
+        index
+            whether the index of the dataframe is written as the first column
+        '''
+        
+        columns = [df.index.name or 'index', *df.columns] if index else list(df.columns)
+        column_list = ', '.join(f'"{column}"' for column in columns)
+        copy_sql = f"COPY \"{table_name}\" ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+        cursor = connection.connection.cursor()
+        
+        for start in range(0, len(df), batch_size):
+            buffer = io.StringIO()
+            df.iloc[start:start + batch_size].to_csv(buffer, header=False, index=index, na_rep='\\N')
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
+        
+        cursor.close()
+    
+    
+    
+    def create_table(self, connection, df, table_name, schema_table=None):
+        
+        '''This function creates a table if it does not exist yet, with the column types and primary key of
+        its star schema definition, or with the types pandas infers from the dataframe if it has none
+        
+        Parameters
+        ----------
+        connection
+            an open connection to the database
+        df
+            the dataframe that will be loaded into the table
+        table_name
+            the name of the table you want to create
+        schema_table
+            the table of STAR_SCHEMA to copy the definition from, or None
+        '''
+        
+        if schema_table is None:
+            df.head(0).to_sql(name=table_name, con=connection, if_exists='append')
+        else:
+            schema_table.to_metadata(MetaData(), name=table_name).create(connection, checkfirst=True)
+    
+    
+    
+    @instrumented('upload_to_db', describe=lambda self, df, table_name, *args, **kwargs: table_name)
+    def upload_to_db(self, df, table_name, if_exists='replace', method='copy', batch_size=100000, staging=False):
+        
+        '''This function takes a dataframe and a table name as arguments and uploads the dataframe to the
+        local database through its cached engine. Tables defined in STAR_SCHEMA are created with their
+        column types and primary key and loaded directly into them. By default the rows are bulk loaded
+        with COPY; when replacing a table they are loaded into a staging table that is swapped in within
+        the same transaction, so readers never see a half-loaded table. A table loaded in several parts is
+        built up in the staging table by passing staging=True and swapped in once with swap_staging.
+        Replacing a table drops the foreign keys that reference it until the schema script is run again.
         
         Parameters
         ----------
@@ -77,16 +279,191 @@ class DatabaseConnector:
             the dataframe you want to upload
         table_name
             the name of the table you want to create in the database
+        if_exists
+            what to do if the table already exists, 'replace' or 'append'
+        method
+            'copy' to bulk load with COPY FROM STDIN, or 'to_sql' to fall back to pandas' INSERTs
+        batch_size
+            the number of rows sent to the database at a time by COPY
+        staging
+            whether to load the rows into the staging table of the table, replacing or appending to it, and
+            leave the table itself untouched until swap_staging is called
+        '''
+        
+        engine = self.init_local_db_engine()
+        schema_table = STAR_SCHEMA.tables.get(table_name)
+        index_label = df.index.name or 'index'
+        if schema_table is not None:
+            df = conform_to_schema(df, schema_table)
+        index = schema_table is None
+        staging_table = f'{table_name}_staging'
+        target_table = staging_table if staging else table_name
+        
+        if method == 'to_sql':
+            if schema_table is None:
+                df.to_sql(name=target_table, con=engine, if_exists=if_exists)
+                return
+            with engine.begin() as connection:
+                if if_exists == 'replace':
+                    connection.execute(text(f'DROP TABLE IF EXISTS "{target_table}" CASCADE'))
+                self.create_table(connection, df, target_table, schema_table)
+                df.to_sql(name=target_table, con=connection, if_exists='append', index=False)
+            return
+        
+        with engine.begin() as connection:
+            if if_exists == 'replace':
+                connection.execute(text(f'DROP TABLE IF EXISTS "{staging_table}"'))
+                self.create_table(connection, df, staging_table, schema_table)
+                self.copy_dataframe(connection, df, staging_table, batch_size, index)
+                if not staging:
+                    self.swap_staging(table_name, index_label, connection)
+            else:
+                self.create_table(connection, df, target_table, schema_table)
+                self.copy_dataframe(connection, df, target_table, batch_size, index)
+    
+    
+    
+    def swap_staging(self, table_name, index_label='index', connection=None):
+        
+        '''This function replaces a table with its staging table in one transaction, so readers see either the
+        old rows or all of the new ones
+        
+        Parameters
+        ----------
+        table_name
+            the name of the table you want to replace
+        index_label
+            the name of the index column of the staging table, whose index is renamed along with it
+        connection
+            an open connection to the local database, or None to swap the tables in a transaction of its own
+        '''
+        
+        if connection is None:
+            with self.init_local_db_engine().begin() as connection:
+                return self.swap_staging(table_name, index_label, connection)
+        
+        staging_table = f'{table_name}_staging'
+        connection.execute(text(f'DROP TABLE IF EXISTS "{table_name}" CASCADE'))
+        connection.execute(text(f'ALTER TABLE "{staging_table}" RENAME TO "{table_name}"'))
+        connection.execute(text(f'ALTER INDEX IF EXISTS "ix_{staging_table}_{index_label}" RENAME TO "ix_{table_name}_{index_label}"'))
+        connection.execute(text(f'ALTER INDEX IF EXISTS "{staging_table}_pkey" RENAME TO "{table_name}_pkey"'))
+    
+    
+    
+    @instrumented('upsert_to_db', describe=lambda self, df, table_name, *args, **kwargs: table_name)
+    def upsert_to_db(self, df, table_name, batch_size=100000):
+        
+        '''This function inserts the rows of a dataframe into a table, updating any row whose key is already
+        in the table with INSERT ... ON CONFLICT. The key is the primary key of the table in STAR_SCHEMA, or
+        the index of the dataframe for other tables. The rows are bulk loaded with COPY into a temporary
+        table first and merged into the target in the same transaction.
+        
+        Parameters
+        ----------
+        df
+            the dataframe you want to upsert
+        table_name
+            the name of the table you want to upsert the rows into
+        batch_size
+            the number of rows sent to the database at a time by COPY
+        '''
+        
+        engine = self.init_local_db_engine()
+        schema_table = STAR_SCHEMA.tables.get(table_name)
+        if schema_table is None:
+            key = df.index.name or 'index'
+            columns = [key, *df.columns]
+        else:
+            df = conform_to_schema(df, schema_table)
+            key = schema_table.primary_key.columns.values()[0].name
+            columns = list(df.columns)
+        column_list = ', '.join(f'"{column}"' for column in columns)
+        updates = ', '.join(f'"{column}" = EXCLUDED."{column}"' for column in columns if column != key)
+        temporary_table = f'{table_name}_upsert'
+        
+        with engine.begin() as connection:
+            self.create_table(connection, df, table_name, schema_table)
+            if schema_table is None:
+                connection.execute(text(f'CREATE UNIQUE INDEX IF NOT EXISTS "ux_{table_name}_{key}" ON "{table_name}" ("{key}")'))
+            connection.execute(text(f'CREATE TEMPORARY TABLE "{temporary_table}" (LIKE "{table_name}") ON COMMIT DROP'))
+            self.copy_dataframe(connection, df, temporary_table, batch_size, index=schema_table is None)
+            connection.execute(text(f'INSERT INTO "{table_name}" ({column_list}) SELECT {column_list} FROM "{temporary_table}" '
+                                    f'ON CONFLICT ("{key}") DO UPDATE SET {updates}'))
+    
+    
+    
+    def read_watermark(self, table_name, connection=None):
+        
+        '''This function returns the highest source index already loaded into a table, as stored in the
+        etl_watermarks table of the local database
+        
+        Parameters
+        ----------
+        table_name
+            the name of the table whose watermark you want
+        connection
+            an open connection to the local database to read it in, or None to read it in a transaction of
+            its own
+        
+        Returns
+        -------
+            The watermark, or None if the table has not been loaded yet.
         '''
         
-        creds_dict = self.read_db_credentials('local_db_creds.yaml')
-        database_type = 'postgresql'
-        dbapi = 'psycopg2'
-        host = creds_dict['HOST']
-        user = creds_dict['USER']
-        password = creds_dict['PASSWORD']
-        database = creds_dict['DATABASE']
-        port = 5432
-        engine = create_engine(f'{database_type}+{dbapi}://{user}:{password}@{host}:{port}/{database}')
-        engine.connect()
-        df.to_sql(name=table_name, con=engine, if_exists='replace')
\ No newline at end of file
+        if connection is None:
+            with self.init_local_db_engine().begin() as connection:
+                return self.read_watermark(table_name, connection)
+        
+        connection.execute(text('CREATE TABLE IF NOT EXISTS etl_watermarks (table_name TEXT PRIMARY KEY, high_water BIGINT NOT NULL)'))
+        
+        return connection.execute(text('SELECT high_water FROM etl_watermarks WHERE table_name = :table_name'),
+                                  {'table_name': table_name}).scalar()
+    
+    
+    
+    def write_watermark(self, table_name, high_water, connection=None):
+        
+        '''This function stores the highest source index loaded into a table in the etl_watermarks table of
+        the local database
+        
+        Parameters
+        ----------
+        table_name
+            the name of the table whose watermark you want to store
+        high_water
+            the highest source index loaded into the table
+        connection
+            an open connection to the local database, so the watermark is committed together with the rows it
+            describes, or None to write it in a transaction of its own
+        '''
+        
+        if connection is None:
+            with self.init_local_db_engine().begin() as connection:
+                return self.write_watermark(table_name, high_water, connection)
+        
+        connection.execute(text('CREATE TABLE IF NOT EXISTS etl_watermarks (table_name TEXT PRIMARY KEY, high_water BIGINT NOT NULL)'))
+        connection.execute(text('INSERT INTO etl_watermarks (table_name, high_water) VALUES (:table_name, :high_water) '
+                                'ON CONFLICT (table_name) DO UPDATE SET high_water = EXCLUDED.high_water'),
+                           {'table_name': table_name, 'high_water': int(high_water)})
+    
+    
+    
+    def delete_watermark(self, table_name, connection=None):
+        
+        '''This function removes the watermark of a table from the etl_watermarks table of the local database,
+        so a table being reloaded is not read as up to date if the reload stops part way
+        
+        Parameters
+        ----------
+        table_name
+            the name of the table whose watermark you want to remove
+        connection
+            an open connection to the local database, or None to remove it in a transaction of its own
+        '''
+        
+        if connection is None:
+            with self.init_local_db_engine().begin() as connection:
+                return self.delete_watermark(table_name, connection)
+        
+        connection.execute(text('CREATE TABLE IF NOT EXISTS etl_watermarks (table_name TEXT PRIMARY KEY, high_water BIGINT NOT NULL)'))
+        connection.execute(text('DELETE FROM etl_watermarks WHERE table_name = :table_name'), {'table_name': table_name})
@@ -0,0 +1,121 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+# The formats the dates of the sources are written in, most common first.
+DATE_FORMATS = ['%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y %B %d', '%Y/%m/%d', '%B %Y %d']
+
+class DateParser:
+    
+    def __init__(self, formats=DATE_FORMATS, cache_file=None):
+        
+        '''It sets up a parser of date strings that parses each distinct string once, keeps what it parsed in
+        a cache shared by every call and counts the strings it could not parse instead of raising
+        
+        Parameters
+        ----------
+        formats
+            the formats to try, in order, before falling back on pandas' own inference
+        cache_file
+            the Parquet file the cache is loaded from and saved to, so it is reused by the next run, or None
+            to keep it in memory only; a file that cannot be read is ignored and the cache starts empty
+        '''
+        
+        self.formats = list(formats)
+        self.cache_file = cache_file
+        self.cache = {}
+        self.unparseable = {}
+        self.lock = threading.Lock()
+        if cache_file and os.path.exists(cache_file):
+            try:
+                cached = pd.read_parquet(cache_file)
+                self.cache = dict(zip(cached['text'], cached['date'].to_numpy(dtype='datetime64[ns]')))
+            except Exception:
+                self.cache = {}
+    
+    
+    
+    def parse_strings(self, strings):
+        
+        '''This function parses an array of distinct strings, trying each format on the strings that are still
+        unparsed, then pandas' inference on each string left over, and leaving NaT where nothing matches
+        
+        Parameters
+        ----------
+        strings
+            an array of distinct date strings
+        
+        Returns
+        -------
+            An array with the datetime64 of each string.
+        '''
+        
+        dates = np.full(len(strings), np.datetime64('NaT'), dtype='datetime64[ns]')
+        remaining = np.arange(len(strings))
+        for date_format in self.formats:
+            if not len(remaining):
+                break
+            parsed = pd.to_datetime(strings[remaining], format=date_format, errors='coerce')
+            dates[remaining] = parsed.to_numpy(dtype='datetime64[ns]')
+            remaining = remaining[parsed.isna()]
+        for position in remaining:
+            dates[position] = pd.to_datetime(strings[position], errors='coerce').to_datetime64()
+        
+        return dates
+    
+    
+    
+    def parse(self, values):
+        
+        '''This function converts a column of date strings to datetimes, parsing only the distinct strings
+        missing from the cache and broadcasting the results back to every row
+        
+        Parameters
+        ----------
+        values
+            the column of date strings
+        
+        Returns
+        -------
+            A datetime64 column with NaT for missing and unparseable values.
+        '''
+        
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return values
+        
+        codes, uniques = pd.factorize(values)
+        uniques = np.asarray(uniques, dtype=object)
+        with self.lock:
+            missing = np.array([text for text in uniques if text not in self.cache], dtype=object)
+        if len(missing):
+            parsed = self.parse_strings(missing.astype(str))
+            with self.lock:
+                self.cache.update(zip(missing, parsed))
+        with self.lock:
+            unique_dates = np.array([self.cache[text] for text in uniques], dtype='datetime64[ns]')
+        
+        dates = np.append(unique_dates, np.datetime64('NaT', 'ns'))[codes]
+        failed = int(np.count_nonzero(np.isnat(dates) & (codes != -1)))
+        if failed:
+            with self.lock:
+                self.unparseable[values.name] = self.unparseable.get(values.name, 0) + failed
+        
+        return pd.Series(dates, index=values.index, name=values.name)
+    
+    
+    
+    def save(self):
+        
+        '''This function writes the cache to the cache file, if there is one, through a temporary file that
+        replaces it once it is complete, so an interrupted save leaves the previous cache in place'''
+        
+        if not self.cache_file:
+            return
+        os.makedirs(os.path.dirname(self.cache_file) or '.', exist_ok=True)
+        with self.lock:
+            cached = pd.DataFrame({'text': [str(text) for text in self.cache.keys()],
+                                   'date': np.array(list(self.cache.values()), dtype='datetime64[ns]')})
+        temporary_file = f'{self.cache_file}.tmp'
+        cached.to_parquet(temporary_file, index=False)
+        os.replace(temporary_file, self.cache_file)
@@ -0,0 +1,380 @@
+import cProfile
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+class Instrumentation:
+    
+    def __init__(self):
+        
+        '''It sets up a recorder of per-stage events, which stays disabled, and close to free, until enable
+        is called'''
+        
+        self.enabled = False
+        self.profile_dir = None
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = None
+    
+    
+    
+    def enable(self, profile_dir=None):
+        
+        '''This function starts recording events, and a cProfile capture of every outermost stage when a
+        directory for the profiles is given
+        
+        Parameters
+        ----------
+        profile_dir
+            the directory the .prof files are written to, or None to skip profiling
+        '''
+        
+        self.enabled = True
+        self.profile_dir = profile_dir
+        self.started = datetime.now().isoformat(timespec='seconds')
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+    
+    
+    
+    def disable(self):
+        
+        '''This function stops recording events'''
+        
+        self.enabled = False
+    
+    
+    
+    def size(self, value):
+        
+        '''This function returns the number of rows and the size in bytes of a dataframe or series, or of the
+        first item of a tuple, and None for anything else. The size includes the strings held by object
+        columns, which takes a pass over them, so it is only measured while instrumentation is enabled'''
+        
+        if isinstance(value, tuple) and value:
+            value = value[0]
+        if hasattr(value, 'memory_usage') and hasattr(value, '__len__'):
+            memory = value.memory_usage(index=True, deep=True)
+            return len(value), int(memory.sum() if hasattr(memory, 'sum') else memory)
+        
+        return None, None
+    
+    
+    
+    def peak_rss(self):
+        
+        '''This function returns the peak resident memory of the process in bytes, where it is available.
+        ru_maxrss is in bytes on macOS and in kilobytes everywhere else'''
+        
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        
+        return peak if sys.platform == 'darwin' else peak * 1024
+    
+    
+    
+    def rss(self):
+        
+        '''This function returns the current resident memory of the process in bytes, where /proc is
+        available, and None elsewhere'''
+        
+        try:
+            with open('/proc/self/statm', 'r') as file:
+                return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            return None
+    
+    
+    
+    def memory_delta(self, rss_before, peak_before):
+        
+        '''This function returns how much the current and the peak resident memory of the process grew since
+        they were measured at the start of a stage. Memory is shared by the whole process, so stages running
+        at the same time in other threads are counted too'''
+        
+        rss_after, peak_after = self.rss(), self.peak_rss()
+        rss_delta = rss_after - rss_before if rss_after is not None and rss_before is not None else None
+        peak_delta = peak_after - peak_before if peak_after is not None and peak_before is not None else None
+        
+        return rss_delta, peak_delta
+    
+    
+    
+    def current_stages(self):
+        
+        '''This function returns the stages running in this thread, outermost first, so work handed to other
+        threads can count its network bytes towards them'''
+        
+        return list(getattr(self.local, 'stack', []))
+    
+    
+    
+    def count_network_bytes(self, nbytes, stages=None):
+        
+        '''This function adds bytes received from the network or S3 to every stage running in this thread,
+        or to the given stages, while instrumentation is enabled
+        
+        Parameters
+        ----------
+        nbytes
+            the number of bytes received
+        stages
+            the stages to count them towards, as returned by current_stages, or None for the stages running
+            in this thread
+        '''
+        
+        if not self.enabled:
+            return
+        if stages is None:
+            stages = getattr(self.local, 'stack', [])
+        with self.lock:
+            for frame in stages:
+                frame['network_bytes'] += nbytes
+    
+    
+    
+    def record(self, stage, detail, wall_time, rows_in, bytes_in, rows_out, bytes_out, profile_path=None, error=None,
+               network_bytes=None, rss_delta=None, peak_rss_delta=None):
+        
+        '''This function stores one event, working out the rows dropped by the stage and the stage it ran
+        inside of'''
+        
+        stack = getattr(self.local, 'stack', [])
+        event = {'stage': stage, 'detail': detail, 'parent': stack[-1]['stage'] if stack else None,
+                 'thread': threading.current_thread().name, 'wall_time': wall_time,
+                 'rows_in': rows_in, 'rows_out': rows_out,
+                 'rows_dropped': rows_in - rows_out if rows_in is not None and rows_out is not None else None,
+                 'bytes_in': bytes_in, 'bytes_out': bytes_out, 'network_bytes': network_bytes,
+                 'rss_delta': rss_delta, 'peak_rss_delta': peak_rss_delta, 'peak_rss': self.peak_rss(),
+                 'profile': profile_path, 'error': error}
+        with self.lock:
+            self.events.append(event)
+    
+    
+    
+    def run(self, stage, detail, function, args, kwargs):
+        
+        '''This function runs a stage, timing it, measuring its input and output, the network bytes it
+        received and the change in memory of the process, and profiling it if it is the outermost stage of
+        its thread and profiling is on'''
+        
+        rows_in, bytes_in = None, None
+        for arg in args:
+            rows_in, bytes_in = self.size(arg)
+            if rows_in is not None:
+                break
+        stack = self.local.__dict__.setdefault('stack', [])
+        profiler = cProfile.Profile() if self.profile_dir and not stack else None
+        frame = {'stage': stage, 'network_bytes': 0}
+        stack.append(frame)
+        error = None
+        result = None
+        rss_before, peak_before = self.rss(), self.peak_rss()
+        
+        start = time.perf_counter()
+        try:
+            if profiler is not None:
+                result = profiler.runcall(function, *args, **kwargs)
+            else:
+                result = function(*args, **kwargs)
+            return result
+        except Exception as exception:
+            error = repr(exception)
+            raise
+        finally:
+            wall_time = time.perf_counter() - start
+            stack.pop()
+            profile_path = None
+            if profiler is not None:
+                profile_path = os.path.join(self.profile_dir, f'{stage}-{len(self.events)}-{threading.get_ident()}.prof')
+                profiler.dump_stats(profile_path)
+            rows_out, bytes_out = self.size(result)
+            rss_delta, peak_rss_delta = self.memory_delta(rss_before, peak_before)
+            self.record(stage, detail, wall_time, rows_in, bytes_in, rows_out, bytes_out, profile_path, error,
+                        frame['network_bytes'], rss_delta, peak_rss_delta)
+    
+    
+    
+    def iterate(self, stage, detail, generator):
+        
+        '''This function passes on the items of a generator stage, such as a chunked reader, counting only
+        the time spent producing them, and records one event once the generator is exhausted'''
+        
+        wall_time = 0
+        rows_out = 0
+        bytes_out = 0
+        frame = {'stage': stage, 'network_bytes': 0}
+        rss_before, peak_before = self.rss(), self.peak_rss()
+        while True:
+            stack = self.local.__dict__.setdefault('stack', [])
+            stack.append(frame)
+            start = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                wall_time += time.perf_counter() - start
+                break
+            finally:
+                stack.pop()
+            wall_time += time.perf_counter() - start
+            rows, size = self.size(item)
+            rows_out += rows or 0
+            bytes_out += size or 0
+            yield item
+        
+        rss_delta, peak_rss_delta = self.memory_delta(rss_before, peak_before)
+        self.record(stage, detail, wall_time, None, None, rows_out, bytes_out, network_bytes=frame['network_bytes'],
+                    rss_delta=rss_delta, peak_rss_delta=peak_rss_delta)
+    
+    
+    
+    def report(self):
+        
+        '''This function summarises the recorded events
+        
+        Returns
+        -------
+            A dictionary with every event and the totals of each stage.
+        '''
+        
+        with self.lock:
+            events = list(self.events)
+        
+        totals = {}
+        for event in events:
+            total = totals.setdefault(event['stage'], {'calls': 0, 'wall_time': 0.0, 'rows_in': 0, 'rows_out': 0, 'rows_dropped': 0,
+                                                       'network_bytes': 0})
+            total['calls'] += 1
+            total['wall_time'] += event['wall_time']
+            for key in ['rows_in', 'rows_out', 'rows_dropped', 'network_bytes']:
+                total[key] += event[key] or 0
+        
+        return {'started': self.started, 'peak_rss': self.peak_rss(), 'totals': totals, 'events': events}
+    
+    
+    
+    def write_report(self, path):
+        
+        '''This function writes the report of the run to a JSON file, with its keys sorted so reports of
+        different runs can be diffed
+        
+        Parameters
+        ----------
+        path
+            the path of the JSON file
+        '''
+        
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=4, sort_keys=True, default=str)
+
+
+
+INSTRUMENTATION = Instrumentation()
+
+class CountingReader:
+    
+    def __init__(self, stream, stages=None):
+        
+        '''It wraps a binary stream, such as an S3 body or a raw HTTP response, counting the bytes read from it
+        as network bytes of the stages reading it
+        
+        Parameters
+        ----------
+        stream
+            the stream to read from
+        stages
+            the stages to count the bytes towards, or None for the stages running in the reading thread
+        '''
+        
+        self.stream = stream
+        self.stages = stages
+    
+    
+    
+    def read(self, size=-1):
+        
+        '''This function reads from the stream and counts the bytes it returned'''
+        
+        data = self.stream.read(size)
+        INSTRUMENTATION.count_network_bytes(len(data), self.stages)
+        
+        return data
+    
+    
+    
+    def readinto(self, buffer):
+        
+        '''This function reads from the stream into a buffer, as parsers such as ijson do, and counts the
+        bytes it filled'''
+        
+        if not hasattr(self.stream, 'readinto'):
+            data = self.stream.read(len(buffer))
+            buffer[:len(data)] = data
+            nbytes = len(data)
+        else:
+            nbytes = self.stream.readinto(buffer) or 0
+        INSTRUMENTATION.count_network_bytes(nbytes, self.stages)
+        
+        return nbytes
+    
+    
+    
+    def __getattr__(self, name):
+        
+        '''This function passes every other attribute on to the wrapped stream'''
+        
+        return getattr(self.stream, name)
+
+
+
+def instrumented(stage, describe=None):
+    
+    '''It decorates a method so each call is recorded as an event of the given stage while instrumentation
+    is enabled, and only costs a flag check while it is not
+    
+    Parameters
+    ----------
+    stage
+        the name of the stage
+    describe
+        a function called with the arguments of the method that returns a short detail, such as the
+        column a filter looks at
+    
+    Returns
+    -------
+        The decorator.
+    '''
+    
+    def decorator(function):
+        
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                if not INSTRUMENTATION.enabled:
+                    return function(*args, **kwargs)
+                detail = describe(*args, **kwargs) if describe else None
+                return INSTRUMENTATION.iterate(stage, detail, function(*args, **kwargs))
+            return generator_wrapper
+        
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not INSTRUMENTATION.enabled:
+                return function(*args, **kwargs)
+            detail = describe(*args, **kwargs) if describe else None
+            return INSTRUMENTATION.run(stage, detail, function, args, kwargs)
+        
+        return wrapper
+    
+    return decorator
@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+class Task:
+    
+    def __init__(self, name, function, dependencies=()):
+        
+        '''It describes one step of the pipeline, such as the extract, clean and load flow of one source
+        
+        Parameters
+        ----------
+        name
+            the unique name of the task
+        function
+            the function that runs the task, called with no arguments
+        dependencies
+            the names of the tasks that have to succeed before this one can start
+        '''
+        
+        self.name = name
+        self.function = function
+        self.dependencies = tuple(dependencies)
+
+
+
+class PipelineRunner:
+    
+    def __init__(self, tasks, max_workers=6, state_file='pipeline_state.json', run_id=None, resume=False):
+        
+        '''It sets up a runner that runs a set of tasks in a thread pool, starting each task as soon as all of
+        its dependencies have succeeded
+        
+        Parameters
+        ----------
+        tasks
+            the list of tasks to run
+        max_workers
+            the maximum number of tasks running at the same time
+        state_file
+            the path of the JSON file recording which tasks of the run have succeeded and how long they took
+        run_id
+            the name of the run; rerunning with the same run_id skips the tasks that already succeeded. When
+            it is None a new run is started under a fresh name
+        resume
+            whether to resume the last run recorded in the state file when no run_id is given
+        '''
+        
+        names = [task.name for task in tasks]
+        if len(set(names)) != len(names):
+            raise ValueError('Task names must be unique')
+        for task in tasks:
+            unknown = [dependency for dependency in task.dependencies if dependency not in names]
+            if unknown:
+                raise ValueError(f'Task {task.name} depends on unknown tasks {unknown}')
+        
+        self.tasks = tasks
+        self.max_workers = max_workers
+        self.state_file = state_file
+        if run_id is None and resume:
+            run_id = self.last_run_id()
+        self.run_id = run_id or datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f')
+        self.state_lock = threading.Lock()
+        self.state = self.load_state()
+    
+    
+    
+    def last_run_id(self):
+        
+        '''This function returns the name of the run recorded in the state file, or None if there is none'''
+        
+        if not self.state_file or not os.path.exists(self.state_file):
+            return None
+        with open(self.state_file, 'r') as file:
+            state = json.load(file)
+        
+        return state.get('run_id')
+    
+    
+    
+    def load_state(self):
+        
+        '''This function reads the state of the run from the state file, starting a new state if the file is
+        missing or belongs to another run
+        
+        Returns
+        -------
+            A dictionary with the run_id, the succeeded tasks and the task timings.
+        '''
+        
+        if self.state_file and os.path.exists(self.state_file):
+            with open(self.state_file, 'r') as file:
+                state = json.load(file)
+            if state.get('run_id') == self.run_id:
+                return state
+        
+        return {'run_id': self.run_id, 'succeeded': [], 'timings': {}}
+    
+    
+    
+    def save_state(self):
+        
+        '''This function writes the state of the run to the state file'''
+        
+        if not self.state_file:
+            return
+        temporary_file = f'{self.state_file}.tmp'
+        with open(temporary_file, 'w') as file:
+            json.dump(self.state, file, indent=4)
+        os.replace(temporary_file, self.state_file)
+    
+    
+    
+    def run_task(self, task):
+        
+        '''This function runs a single task and records its wall time
+        
+        Parameters
+        ----------
+        task
+            the task to run
+        
+        Returns
+        -------
+            The wall time of the task in seconds.
+        '''
+        
+        start = time.perf_counter()
+        task.function()
+        
+        return time.perf_counter() - start
+    
+    
+    
+    def run(self):
+        
+        '''This function runs every task that has not already succeeded in this run, running independent
+        tasks concurrently, and raises a RuntimeError naming the tasks that failed or could not start
+        
+        Returns
+        -------
+            A dictionary of the wall time of each task in seconds.
+        '''
+        
+        succeeded = set(self.state['succeeded'])
+        pending = {task.name: task for task in self.tasks if task.name not in succeeded}
+        failed = {}
+        running = {}
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for name, task in list(pending.items()):
+                    if any(dependency in failed for dependency in task.dependencies):
+                        failed[name] = 'a dependency failed'
+                        del pending[name]
+                    elif all(dependency in succeeded for dependency in task.dependencies):
+                        running[executor.submit(self.run_task, task)] = name
+                        del pending[name]
+                
+                if not running:
+                    break
+                
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        wall_time = future.result()
+                    except Exception as error:
+                        failed[name] = repr(error)
+                        continue
+                    succeeded.add(name)
+                    with self.state_lock:
+                        self.state['succeeded'].append(name)
+                        self.state['timings'][name] = wall_time
+                        self.save_state()
+        
+        if failed:
+            raise RuntimeError(f'Pipeline tasks failed: {failed}')
+        
+        return dict(self.state['timings'])
@@ -1,47 +1,206 @@
+import argparse
+import pandas as pd
 from database_utils import DatabaseConnector
-from data_extraction import DataExtractor
+from data_extraction import DataExtractor, PRODUCTS_DTYPES
 from data_cleaning import DataCleaner
+from date_parser import DateParser
+from instrumentation import INSTRUMENTATION
+from pipeline_runner import PipelineRunner, Task
+from sales_metrics import SalesMetrics
+from source_cache import SourceCache
 
-def main():
-# Creating an instance of the DatabaseConnector, DataExtractor and DataCleaner classes.
-    dbcon = DatabaseConnector()
-    dbex = DataExtractor()
-    dbclean = DataCleaner()
+CHUNKSIZE = 50000
+
+# The file the parsed date strings are kept in between runs, so repeated dates are only parsed once.
+DATE_CACHE_FILE = '.date_cache.parquet'
+
+# The row added to the store details for orders placed online, which have no physical store.
+WEB_STORE = {'store_code': 'WEB-1388012W', 'staff_numbers': 325, 'opening_date': pd.Timestamp('2010-06-12'), 'store_type': 'Web Portal'}
+
+# The foreign keys of the orders and the dimension tables they refer to. Orders whose keys are missing
+# from a dimension are dropped before they are loaded.
+ORDER_FOREIGN_KEYS = {'store_code': 'dim_store_details', 'product_code': 'dim_products', 'user_uuid': 'dim_users'}
+
+def clean_upload_chunks(dbcon, chunks, clean_function, target_table, renumber=True):
+# Cleaning a stream of chunks one at a time and appending each to the staging table of the target table,
+# so memory use is bounded by the chunk size rather than the size of the source, then swapping the
+# staging table in once the last chunk is loaded, so readers never see a partly loaded table. Cleaners
+# that reset the index get it renumbered so it keeps counting up across chunks. Returns the highest
+# source index seen.
+    rows_uploaded = 0
+    high_water = None
+    index_label = None
+    if_exists = 'replace'
+    for chunk in chunks:
+        high_water = max(chunk.index.max(), high_water) if high_water is not None else chunk.index.max()
+        clean_chunk = clean_function(chunk)
+        if renumber:
+            clean_chunk.index = pd.RangeIndex(rows_uploaded, rows_uploaded + len(clean_chunk))
+        dbcon.upload_to_db(clean_chunk, target_table, if_exists=if_exists, staging=True)
+        index_label = clean_chunk.index.name or 'index'
+        rows_uploaded += len(clean_chunk)
+        if_exists = 'append'
+    if index_label is not None:
+        dbcon.swap_staging(target_table, index_label)
+    
+    return high_water
+
+def stream_clean_upload(dbcon, dbex, clean_function, source_table, target_table, chunksize=CHUNKSIZE, renumber=True):
+# Streaming a table from the database in chunks, cleaning each chunk and appending it to the target table.
+    chunks = dbex.stream_rds_table(dbcon, source_table, chunksize)
+    
+    return clean_upload_chunks(dbcon, chunks, clean_function, target_table, renumber)
+
+def collect_keys(clean_function, column, keys):
+# Wrapping a clean function so the values of a key column of every cleaned chunk are kept, to check the
+# orders against them later.
+    def clean_and_collect(df):
+        clean_df = clean_function(df)
+        keys.setdefault(column, []).append(clean_df[column].astype(str))
+        return clean_df
     
+    return clean_and_collect
+
+def incremental_clean_upload(dbcon, dbex, clean_function, source_table, target_table, full_refresh=False, chunksize=CHUNKSIZE):
+# Extracting only the rows past the table's watermark, cleaning them and upserting them into the target
+# table, moving the watermark on after every chunk. Without a watermark, or on a full refresh, the old
+# watermark is removed before the first chunk is written, the whole table is reloaded and the watermark
+# is set from scratch.
+    watermark = None if full_refresh else dbcon.read_watermark(target_table)
+    if watermark is None:
+        dbcon.delete_watermark(target_table)
+        high_water = stream_clean_upload(dbcon, dbex, clean_function, source_table, target_table, chunksize, renumber=False)
+        if high_water is not None:
+            dbcon.write_watermark(target_table, high_water)
+        return
+    for chunk in dbex.stream_rds_table(dbcon, source_table, chunksize, watermark=watermark):
+        high_water = chunk.index.max()
+        dbcon.upsert_to_db(clean_function(chunk), target_table)
+        dbcon.write_watermark(target_table, high_water)
+
+def main(full_refresh=False, run_id=None, resume=False, max_workers=6, refresh_sources=False, report=None, profile_dir=None, clean_workers=1):
+# Creating an instance of the DatabaseConnector, DataExtractor and DataCleaner classes. The connector
+# keeps one pooled engine per database for the whole run and disposes of them when the run ends, and
+# the extractor keeps parsed copies of the remote files so unchanged files are not parsed again. The
+# cleaner parses each distinct date string once, reusing the dates parsed by earlier runs, and splits
+# the users between clean_workers processes. The orders only lose a few columns, which is cheaper than
+# sending them to the workers and back.
+    if report or profile_dir:
+        INSTRUMENTATION.enable(profile_dir)
+    
+    with DatabaseConnector() as dbcon:
+        dbex = DataExtractor(cache=SourceCache())
+        dbclean = DataCleaner(date_parser=DateParser(cache_file=DATE_CACHE_FILE), max_workers=clean_workers)
+        dimension_keys = {}
+        orphan_counts = {}
+        
 # Reading the legacy_users table from the database, cleaning the data and uploading it to the
 # dim_users table.
-    user_df = dbex.read_rds_table(dbcon, 'legacy_users')
-    clean_user_df = dbclean.clean_user_data(user_df)
-    dbcon.upload_to_db(clean_user_df, 'dim_users')
-    
+        def users_flow():
+            clean_user_data = collect_keys(lambda df: dbclean.clean_in_partitions('clean_user_data', df), 'user_uuid', dimension_keys)
+            stream_clean_upload(dbcon, dbex, clean_user_data, 'legacy_users', 'dim_users')
+        
 # This is reading the card_details.pdf file from the s3 bucket, cleaning the data and uploading it to
 # the dim_card_details table.
-    card_df = dbex.retrieve_pdf_data('https://data-handling-public.s3.eu-west-1.amazonaws.com/card_details.pdf')
-    clean_card_df = dbclean.clean_card_data(card_df)
-    dbcon.upload_to_db(clean_card_df, 'dim_card_details')
-    
-# This is getting the data from the api, cleaning the data and uploading it to the dim_store_details table.
-    api_creds = dbcon.read_db_credentials('api_creds.yaml')
-    store_df = dbex.retrieve_stores_data('https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod/number_stores', 'https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod/store_details', api_creds)
-    clean_store_df = dbclean.clean_store_data(store_df)
-    dbcon.upload_to_db(clean_store_df, 'dim_store_details')
-    
-# This is reading the products.csv file from the s3 bucket, cleaning the data and uploading it to
-# the dim_products table.
-    product_df = dbex.extract_from_s3('s3://data-handling-public/products.csv')
-    clean_product_df = dbclean.clean_products_data(product_df)
-    dbcon.upload_to_db(clean_product_df, 'dim_products')
-
-# Reading the orders_table from the database, cleaning the data and uploading it to the orders_table.
-    order_df = dbex.read_rds_table(dbcon, 'orders_table')
-    clean_order_df = dbclean.clean_orders_data(order_df)
-    dbcon.upload_to_db(clean_order_df, 'orders_table')
-    
+        def cards_flow():
+            card_df = dbex.retrieve_pdf_data('https://data-handling-public.s3.eu-west-1.amazonaws.com/card_details.pdf', refresh=refresh_sources)
+            clean_card_df = dbclean.clean_card_data(card_df)
+            dbcon.upload_to_db(clean_card_df, 'dim_card_details')
+        
+# This is getting the data from the api, cleaning the data, adding the web store and uploading it to the
+# dim_store_details table.
+        def stores_flow():
+            api_creds = dbcon.read_db_credentials('api_creds.yaml')
+            store_df = dbex.retrieve_stores_data('https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod/number_stores', 'https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod/store_details', api_creds)
+            clean_store_data = collect_keys(dbclean.clean_store_data, 'store_code', dimension_keys)
+            clean_store_df = clean_store_data(store_df)
+            clean_store_df = pd.concat([clean_store_df, pd.DataFrame([WEB_STORE])], ignore_index=True)
+            dimension_keys['store_code'].append(pd.Series([WEB_STORE['store_code']]))
+            dbcon.upload_to_db(clean_store_df, 'dim_store_details')
+        
+# This is streaming the products.csv file from the s3 bucket with explicit column types, cleaning it
+# chunk by chunk and uploading it to the dim_products table.
+        def products_flow():
+            product_chunks = dbex.stream_from_s3('s3://data-handling-public/products.csv', dtype=PRODUCTS_DTYPES, chunksize=CHUNKSIZE)
+            clean_products_data = collect_keys(dbclean.clean_products_data, 'product_code', dimension_keys)
+            clean_upload_chunks(dbcon, product_chunks, clean_products_data, 'dim_products')
+
+# Reading the new rows of the orders_table from the database, cleaning them, dropping the orders whose
+# store, product or user is missing from the cleaned dimensions and upserting them into the orders_table,
+# or reloading the whole table on a full refresh. Dimensions loaded by an earlier attempt of this run
+# have their keys read back from the database.
+        def orders_flow():
+            key_sets = {}
+            for column, table_name in ORDER_FOREIGN_KEYS.items():
+                if column in dimension_keys:
+                    key_sets[column] = pd.Index(pd.concat(dimension_keys[column])).unique()
+                else:
+                    key_sets[column] = dbcon.read_key_set(table_name, column)
+            
+            def clean_orders_data(df):
+                clean_order_df, counts = dbclean.filter_orphans(dbclean.clean_orders_data(df), key_sets)
+                for column, count in counts.items():
+                    orphan_counts[column] = orphan_counts.get(column, 0) + count
+                return clean_order_df
+            
+            incremental_clean_upload(dbcon, dbex, clean_orders_data, 'orders_table', 'orders_table', full_refresh)
+        
 # This is reading the date_details.json file from the s3 bucket, cleaning the data and uploading it to
 # the dim_date_times table.
-    date_times_df = dbex.extract_json_data('https://data-handling-public.s3.eu-west-1.amazonaws.com/date_details.json')
-    clean_date_times_df = dbclean.clean_date_times_data(date_times_df)
-    dbcon.upload_to_db(clean_date_times_df, 'dim_date_times')
+        def date_times_flow():
+            date_times_df = dbex.extract_json_data('https://data-handling-public.s3.eu-west-1.amazonaws.com/date_details.json', refresh=refresh_sources)
+            clean_date_times_df = dbclean.clean_date_times_data(date_times_df)
+            dbcon.upload_to_db(clean_date_times_df, 'dim_date_times')
+        
+# Setting the foreign keys once every table has been loaded.
+        def schema_flow():
+            dbcon.run_sql_file('SQL_schema.sql')
+        
+# Adding the newly loaded orders to the sales summary tables the business metrics are read from.
+        def metrics_flow():
+            SalesMetrics(dbcon).refresh(full=full_refresh)
+        
+# Running the independent flows concurrently and the orders once every dimension is loaded, since the
+# dimension flows drop their tables along with the foreign keys of the orders_table and would deadlock
+# with the upsert. The schema step runs after all of them and the metrics refresh last. Every run starts afresh unless a run_id
+# is given or the last run is resumed, in which case the flows that already succeeded are skipped.
+        flows = ['users', 'cards', 'stores', 'products', 'orders', 'date_times']
+        tasks = [Task('users', users_flow),
+                 Task('cards', cards_flow),
+                 Task('stores', stores_flow),
+                 Task('products', products_flow),
+                 Task('orders', orders_flow, dependencies=['users', 'cards', 'stores', 'products', 'date_times']),
+                 Task('date_times', date_times_flow),
+                 Task('schema', schema_flow, dependencies=flows),
+                 Task('metrics', metrics_flow, dependencies=['schema'])]
+        runner = PipelineRunner(tasks, max_workers=max_workers, run_id=run_id, resume=resume)
+        try:
+            timings = runner.run()
+        finally:
+            dbclean.close()
+            dbclean.date_parser.save()
+            if report:
+                INSTRUMENTATION.write_report(report)
+        
+        for name, wall_time in timings.items():
+            print(f'{name}: {wall_time:.1f}s')
+        for column, count in orphan_counts.items():
+            print(f'orders dropped for a missing {column}: {count}')
+        for column, count in dbclean.date_parser.unparseable.items():
+            print(f'unparseable dates in {column}: {count}')
+        if dbclean.unparseable_weights:
+            print(f'products dropped for an unparseable weight: {dbclean.unparseable_weights}')
 
-main()
-    
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract, clean and load the retail data into the local database.')
+    parser.add_argument('--full-refresh', action='store_true', help='reload the orders_table from scratch instead of only the new orders')
+    parser.add_argument('--run-id', help='the name of the run, defaults to a fresh name; rerunning a run skips the flows that already succeeded')
+    parser.add_argument('--resume', action='store_true', help='resume the last run, skipping the flows that already succeeded')
+    parser.add_argument('--refresh-sources', action='store_true', help='download and parse the remote files even if they are cached')
+    parser.add_argument('--report', help='write a JSON report of the time, rows and memory of every stage to this file')
+    parser.add_argument('--profile', help='write a cProfile capture of every stage to this directory')
+    parser.add_argument('--max-workers', type=int, default=6, help='the number of flows run at the same time')
+    parser.add_argument('--clean-workers', type=int, default=1, help='the number of processes the users are cleaned in')
+    args = parser.parse_args()
+    main(full_refresh=args.full_refresh, run_id=args.run_id, resume=args.resume, max_workers=args.max_workers, refresh_sources=args.refresh_sources,
+         report=args.report, profile_dir=args.profile, clean_workers=args.clean_workers)
@@ -0,0 +1,274 @@
+import threading
+import pandas as pd
+from sqlalchemy import text
+
+CREATE_SUMMARY_TABLES = [
+    '''CREATE TABLE IF NOT EXISTS sales_daily_summary (
+        year CHAR(4), month CHAR(2), day CHAR(2), store_code VARCHAR(12),
+        number_of_sales BIGINT NOT NULL, product_quantity BIGINT NOT NULL, total_sales FLOAT NOT NULL,
+        PRIMARY KEY (year, month, day, store_code))''',
+    '''ALTER TABLE sales_daily_summary DROP COLUMN IF EXISTS store_type, DROP COLUMN IF EXISTS country_code''',
+    '''DROP TABLE IF EXISTS sales_time_taken''',
+    '''CREATE TABLE IF NOT EXISTS sales_time_gaps (year CHAR(4) PRIMARY KEY, total_gap INTERVAL NOT NULL, gaps BIGINT NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS sales_summary_state (
+        id INT PRIMARY KEY CHECK (id = 1), version BIGINT NOT NULL, last_datetime TIMESTAMPTZ)''',
+    '''INSERT INTO sales_summary_state (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING''',
+]
+
+# Adds the orders between the watermark and the high-water mark read in the same transaction to the daily totals of each store.
+# The attributes of the stores are joined at query time, so a reload of dim_store_details is seen by every day.
+REFRESH_DAILY_SUMMARY = '''
+INSERT INTO sales_daily_summary (year, month, day, store_code, number_of_sales, product_quantity, total_sales)
+SELECT d.year, d.month, d.day, o.store_code, COUNT(*), SUM(o.product_quantity), SUM(o.product_quantity * p."price_£")
+FROM orders_table o
+    JOIN dim_date_times d ON o.date_uuid = d.date_uuid
+    JOIN dim_products p ON o.product_code = p.product_code
+WHERE o."index" > :watermark AND o."index" <= :high_water
+GROUP BY d.year, d.month, d.day, o.store_code
+ON CONFLICT (year, month, day, store_code) DO UPDATE SET
+    number_of_sales = sales_daily_summary.number_of_sales + EXCLUDED.number_of_sales,
+    product_quantity = sales_daily_summary.product_quantity + EXCLUDED.product_quantity,
+    total_sales = sales_daily_summary.total_sales + EXCLUDED.total_sales'''
+
+# The date and time of each row of dim_date_times, read only from the years from the last datetime summarised on.
+NEW_DATETIMES = '''
+SELECT d.year, TO_TIMESTAMP(CONCAT(d.year, '-', d.month, '-', d.day, ' ', d.timestamp), 'YYYY-MM-DD HH24:MI:SS') AS datetimes
+FROM dim_date_times d, sales_summary_state s
+WHERE d.year >= COALESCE(TO_CHAR(s.last_datetime, 'YYYY'), '0000')'''
+
+# Adds the gaps between each sale after the last datetime summarised and the sale before it, the first of them
+# measured from the last datetime itself, to the running sums and counts of each year.
+REFRESH_TIME_GAPS = f'''
+INSERT INTO sales_time_gaps (year, total_gap, gaps)
+WITH new_datetimes AS ({NEW_DATETIMES}
+), gaps AS (
+    SELECT n.year, n.datetimes - COALESCE(LAG(n.datetimes) OVER (ORDER BY n.datetimes), s.last_datetime) AS gap
+    FROM new_datetimes n, sales_summary_state s
+    WHERE s.last_datetime IS NULL OR n.datetimes > s.last_datetime
+) SELECT year, SUM(gap), COUNT(gap) FROM gaps WHERE gap IS NOT NULL GROUP BY year
+ON CONFLICT (year) DO UPDATE SET
+    total_gap = sales_time_gaps.total_gap + EXCLUDED.total_gap,
+    gaps = sales_time_gaps.gaps + EXCLUDED.gaps'''
+
+# Moves the last datetime summarised on and counts the refresh, which every process keys its query cache on so
+# that a refresh made by another process is seen by the next query.
+ADVANCE_SUMMARY_STATE = f'''
+UPDATE sales_summary_state SET version = version + 1,
+    last_datetime = GREATEST(last_datetime, (SELECT MAX(datetimes) FROM ({NEW_DATETIMES}) n))'''
+
+class SalesMetrics:
+    
+    def __init__(self, db_connector):
+        
+        '''It sets up the sales metrics of the business on top of summary tables of the orders, which are
+        refreshed incrementally after each load, and keeps the result of each query until the summary tables
+        are next refreshed, by this or any other process
+        
+        Parameters
+        ----------
+        db_connector
+            the database connector object
+        '''
+        
+        self.db_connector = db_connector
+        self.cache = {}
+        self.cache_version = None
+        self.cache_lock = threading.Lock()
+        self.tables_created = False
+    
+    
+    
+    def create_tables(self, connection):
+        
+        '''This function creates the summary tables and the row of their state if they do not exist yet
+        
+        Parameters
+        ----------
+        connection
+            an open connection to the local database
+        '''
+        
+        for statement in CREATE_SUMMARY_TABLES:
+            connection.execute(text(statement))
+        self.tables_created = True
+    
+    
+    
+    def refresh(self, full=False):
+        
+        '''This function brings the summary tables up to date with the orders_table and dim_date_times, adding
+        only the orders loaded and the sales made since the last refresh unless a full rebuild is asked for,
+        and moves on the refresh counter the query caches are keyed on. The orders added are bounded by the
+        highest index seen at the start, and the new watermark is committed in the same transaction as the
+        totals, so no order is ever added twice. Sales dated before the last one summarised are only counted
+        by a full rebuild
+        
+        Parameters
+        ----------
+        full
+            whether to rebuild the summary tables from every order
+        '''
+        
+        engine = self.db_connector.init_local_db_engine()
+        
+        with engine.begin() as connection:
+            self.create_tables(connection)
+            watermark = None if full else self.db_connector.read_watermark('sales_daily_summary', connection)
+            if watermark is None:
+                connection.execute(text('TRUNCATE sales_daily_summary, sales_time_gaps'))
+                connection.execute(text('UPDATE sales_summary_state SET last_datetime = NULL'))
+                watermark = -1
+            high_water = connection.execute(text('SELECT MAX("index") FROM orders_table')).scalar()
+            if high_water is not None:
+                params = {'watermark': watermark, 'high_water': high_water}
+                connection.execute(text(REFRESH_DAILY_SUMMARY), params)
+                self.db_connector.write_watermark('sales_daily_summary', max(high_water, watermark), connection)
+            connection.execute(text(REFRESH_TIME_GAPS))
+            connection.execute(text(ADVANCE_SUMMARY_STATE))
+        
+        with self.cache_lock:
+            self.cache.clear()
+            self.cache_version = None
+    
+    
+    
+    def query(self, sql, **params):
+        
+        '''This function runs a query against the summary tables, returning the cached result if the same
+        query has already been run since the last refresh. The refresh counter is looked up first, and the
+        cache is emptied when it has moved on. The summary tables are created on the first query if no
+        refresh has made them yet
+        
+        Parameters
+        ----------
+        sql
+            the query to run
+        params
+            the values of the parameters of the query
+        
+        Returns
+        -------
+            A dataframe
+        '''
+        
+        key = (sql, tuple(sorted(params.items())))
+        engine = self.db_connector.init_local_db_engine()
+        if not self.tables_created:
+            with engine.begin() as connection:
+                self.create_tables(connection)
+        with engine.connect() as connection:
+            version = connection.execute(text('SELECT version FROM sales_summary_state')).scalar()
+            with self.cache_lock:
+                if version != self.cache_version:
+                    self.cache.clear()
+                    self.cache_version = version
+                if key in self.cache:
+                    return self.cache[key].copy()
+            df = pd.read_sql_query(text(sql), con=connection, params=params)
+        
+        with self.cache_lock:
+            if version == self.cache_version:
+                self.cache[key] = df
+        
+        return df.copy()
+    
+    
+    
+    def sales_by_month(self):
+        
+        '''This function returns the total sales of each month of the year, highest first
+        
+        Returns
+        -------
+            A dataframe of total_sales and month.
+        '''
+        
+        return self.query('''SELECT SUM(total_sales) AS total_sales, month FROM sales_daily_summary
+                             GROUP BY month ORDER BY total_sales DESC''')
+    
+    
+    
+    def sales_by_year_and_month(self, limit=5):
+        
+        '''This function returns the months of each year with the highest total sales
+        
+        Parameters
+        ----------
+        limit
+            the number of months to return
+        
+        Returns
+        -------
+            A dataframe of total_sales, year and month.
+        '''
+        
+        return self.query('''SELECT SUM(total_sales) AS total_sales, year, month FROM sales_daily_summary
+                             GROUP BY year, month ORDER BY total_sales DESC LIMIT :limit''', limit=limit)
+    
+    
+    
+    def online_and_offline_sales(self):
+        
+        '''This function returns the number of sales and the number of products sold online and offline
+        
+        Returns
+        -------
+            A dataframe of number_of_sales, product_quantity_count and location.
+        '''
+        
+        return self.query('''SELECT SUM(number_of_sales) AS number_of_sales, SUM(product_quantity) AS product_quantity_count,
+                                 CASE WHEN store_code LIKE 'WEB%' THEN 'Web' ELSE 'Offline' END AS location
+                             FROM sales_daily_summary GROUP BY location''')
+    
+    
+    
+    def sales_by_store_type(self):
+        
+        '''This function returns the total sales of each type of store and its percentage of all sales
+        
+        Returns
+        -------
+            A dataframe of store_type, total_sales and percentage_total.
+        '''
+        
+        return self.query('''SELECT s.store_type, SUM(t.total_sales) AS total_sales,
+                                 ROUND((SUM(t.total_sales)::numeric / SUM(SUM(t.total_sales)::numeric) OVER ()) * 100.0, 2) AS percentage_total
+                             FROM (SELECT store_code, SUM(total_sales) AS total_sales FROM sales_daily_summary GROUP BY store_code) t
+                                 JOIN dim_store_details s ON t.store_code = s.store_code
+                             WHERE s.store_type IS NOT NULL
+                             GROUP BY s.store_type ORDER BY total_sales DESC''')
+    
+    
+    
+    def store_type_sales_in_country(self, country_code='DE'):
+        
+        '''This function returns the total sales of each type of store in one country, lowest first
+        
+        Parameters
+        ----------
+        country_code
+            the country to look at
+        
+        Returns
+        -------
+            A dataframe of total_sales, store_type and country_code.
+        '''
+        
+        return self.query('''SELECT SUM(t.total_sales) AS total_sales, s.store_type, s.country_code
+                             FROM (SELECT store_code, SUM(total_sales) AS total_sales FROM sales_daily_summary GROUP BY store_code) t
+                                 JOIN dim_store_details s ON t.store_code = s.store_code
+                             WHERE s.country_code = :country_code
+                             GROUP BY s.store_type, s.country_code ORDER BY total_sales''', country_code=country_code)
+    
+    
+    
+    def time_taken_by_year(self):
+        
+        '''This function returns the average time between two sales in each year, longest first
+        
+        Returns
+        -------
+            A dataframe of year and actual_time_taken.
+        '''
+        
+        return self.query('''SELECT year, total_gap / gaps AS actual_time_taken FROM sales_time_gaps ORDER BY actual_time_taken DESC''')
@@ -0,0 +1,191 @@
+import hashlib
+import os
+import threading
+import boto3
+import requests
+import pandas as pd
+
+class SourceCache:
+    
+    def __init__(self, cache_dir='.source_cache', max_bytes=1024 ** 3, s3_client=None, timeout=30):
+        
+        '''It sets up a local cache of parsed remote sources, stored as Parquet files in cache_dir and keyed
+        on the source, its ETag or Last-Modified header (or the content hash of a local file) and the
+        variant of the parse. The cache can be shared by flows running in different threads
+        
+        Parameters
+        ----------
+        cache_dir
+            the directory the Parquet files are kept in
+        max_bytes
+            the total size of the cache above which the least recently used entries are evicted
+        s3_client
+            the boto3 client used to look up the ETag of s3:// sources, created when first needed
+        timeout
+            the number of seconds to wait for the HEAD request of http(s) sources
+        '''
+        
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.s3_client = s3_client
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+    
+    
+    
+    def source_version(self, source):
+        
+        '''This function returns a string that changes whenever the content of the source changes
+        
+        Parameters
+        ----------
+        source
+            an http(s) URL, an s3:// address or a local file path
+        
+        Returns
+        -------
+            The ETag or Last-Modified header of the source, or the content hash of a local file, or None if
+            the source cannot be versioned.
+        '''
+        
+        if source.startswith(('http://', 'https://')):
+            response = requests.head(source, allow_redirects=True, timeout=self.timeout)
+            response.raise_for_status()
+            return response.headers.get('ETag') or response.headers.get('Last-Modified')
+        
+        if source.startswith('s3://'):
+            if self.s3_client is None:
+                self.s3_client = boto3.client('s3')
+            bucket, key = source[len('s3://'):].split('/', 1)
+            return self.s3_client.head_object(Bucket=bucket, Key=key)['ETag']
+        
+        if os.path.isfile(source):
+            digest = hashlib.sha256()
+            with open(source, 'rb') as file:
+                for block in iter(lambda: file.read(1024 * 1024), b''):
+                    digest.update(block)
+            return digest.hexdigest()
+        
+        return None
+    
+    
+    
+    def entry_path(self, source, version, variant=''):
+        
+        '''This function returns the path of the Parquet file for one version of a source
+        
+        Parameters
+        ----------
+        source
+            the address of the source
+        version
+            the version of the source returned by source_version
+        variant
+            a string describing how the source was parsed
+        
+        Returns
+        -------
+            The path of the cache entry.
+        '''
+        
+        key = hashlib.sha256(f'{source}\n{version}\n{variant}'.encode()).hexdigest()
+        
+        return os.path.join(self.cache_dir, f'{key}.parquet')
+    
+    
+    
+    def normalise_object_columns(self, df):
+        
+        '''It converts the values of object columns that mix strings with other types, such as card numbers
+        read as both numbers and text, to strings so the dataframe can be written to Parquet
+        
+        Parameters
+        ----------
+        df
+            the dataframe to normalise
+        
+        Returns
+        -------
+            The dataframe with every non-null value of its object columns stored as a string.
+        '''
+        
+        for column in df.columns[df.dtypes == 'object']:
+            values = df[column]
+            mask = values.notna() & ~values.map(lambda x: isinstance(x, str))
+            if mask.any():
+                df[column] = values.where(~mask, values[mask].astype(str))
+        
+        return df
+    
+    
+    
+    def evict(self):
+        
+        '''This function removes the least recently used entries until the cache fits in max_bytes, skipping
+        entries that are removed by someone else in the meantime'''
+        
+        with self.lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.parquet'):
+                    try:
+                        stat = os.stat(os.path.join(self.cache_dir, name))
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, name))
+            
+            total_bytes = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    pass
+                total_bytes -= size
+    
+    
+    
+    def get_or_create(self, source, loader, variant='', refresh=False):
+        
+        '''This function returns the dataframe of a source from the cache if the source has not changed, and
+        otherwise calls the loader and stores its dataframe in the cache. An entry evicted while it is being
+        looked up is treated as missing
+        
+        Parameters
+        ----------
+        source
+            the address of the source
+        loader
+            a function with no arguments that downloads and parses the source into a dataframe
+        variant
+            a string describing how the source is parsed, so different parses are cached apart
+        refresh
+            whether to ignore any cached entry and call the loader
+        
+        Returns
+        -------
+            A dataframe
+        '''
+        
+        version = self.source_version(source)
+        if version is None:
+            return loader()
+        
+        path = self.entry_path(source, version, variant)
+        if not refresh:
+            with self.lock:
+                try:
+                    os.utime(path)
+                    return pd.read_parquet(path)
+                except FileNotFoundError:
+                    pass
+        
+        df = self.normalise_object_columns(loader())
+        temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        df.to_parquet(temporary_path)
+        os.replace(temporary_path, path)
+        self.evict()
+        
+        return df
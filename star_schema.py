@@ -0,0 +1,119 @@
+import numpy as np
+from sqlalchemy import BigInteger, Boolean, CHAR, Column, Date, Float, MetaData, SmallInteger, Table, Text, VARCHAR
+from sqlalchemy.dialects.postgresql import UUID
+
+# The typed definition of the tables in the local database. upload_to_db creates these tables with their
+# column types and primary keys before loading them, so no table has to be rewritten afterwards.
+STAR_SCHEMA = MetaData()
+
+Table('orders_table', STAR_SCHEMA,
+      Column('index', BigInteger, primary_key=True),
+      Column('date_uuid', UUID),
+      Column('user_uuid', UUID),
+      Column('card_number', VARCHAR(19)),
+      Column('store_code', VARCHAR(12)),
+      Column('product_code', VARCHAR(11)),
+      Column('product_quantity', SmallInteger))
+
+Table('dim_users', STAR_SCHEMA,
+      Column('first_name', VARCHAR(255)),
+      Column('last_name', VARCHAR(255)),
+      Column('date_of_birth', Date),
+      Column('company', Text),
+      Column('email_address', Text),
+      Column('address', Text),
+      Column('country', Text),
+      Column('country_code', VARCHAR(2)),
+      Column('phone_number', Text),
+      Column('join_date', Date),
+      Column('user_uuid', UUID, primary_key=True))
+
+Table('dim_card_details', STAR_SCHEMA,
+      Column('card_number', VARCHAR(19), primary_key=True),
+      Column('expiry_date', VARCHAR(5)),
+      Column('card_provider', Text),
+      Column('date_payment_confirmed', Date))
+
+Table('dim_store_details', STAR_SCHEMA,
+      Column('address', Text),
+      Column('longitude', Float),
+      Column('latitude', Float),
+      Column('locality', VARCHAR(255)),
+      Column('store_code', VARCHAR(50), primary_key=True),
+      Column('staff_numbers', SmallInteger),
+      Column('opening_date', Date),
+      Column('store_type', VARCHAR(255)),
+      Column('country_code', VARCHAR(2)),
+      Column('continent', VARCHAR(255)))
+
+Table('dim_products', STAR_SCHEMA,
+      Column('product_name', Text),
+      Column('price_£', Float),
+      Column('weight_kg', Float),
+      Column('category', Text),
+      Column('EAN', VARCHAR(50)),
+      Column('date_added', Date),
+      Column('uuid', UUID),
+      Column('still_available', Boolean),
+      Column('product_code', VARCHAR(50), primary_key=True),
+      Column('weight_class', VARCHAR(14)))
+
+Table('dim_date_times', STAR_SCHEMA,
+      Column('timestamp', Text),
+      Column('month', CHAR(2)),
+      Column('year', CHAR(4)),
+      Column('day', CHAR(2)),
+      Column('time_period', VARCHAR(11)),
+      Column('date_uuid', UUID, primary_key=True))
+
+STILL_AVAILABLE_VALUES = ['Still_available', 'Still_avaliable']
+
+def weight_class(weight_kg):
+    
+    '''It puts each product weight into the weight class used by the business, following the same bands
+    as the CASE statement the weight_class column used to be filled with
+    
+    Parameters
+    ----------
+    weight_kg
+        the column of product weights in kg
+    
+    Returns
+    -------
+        An array with the weight class of each product.
+    '''
+    
+    conditions = [weight_kg < 2, weight_kg.between(3, 40), weight_kg.between(41, 140)]
+    
+    return np.select(conditions, ['Light', 'Mid_Sized', 'Heavy'], default='Truck_required')
+
+
+
+def conform_to_schema(df, table):
+    
+    '''It reshapes a cleaned dataframe into the columns of its table in the star schema, adding the derived
+    columns and leaving out any column the table does not have
+    
+    Parameters
+    ----------
+    df
+        the cleaned dataframe
+    table
+        the table of STAR_SCHEMA the dataframe is loaded into
+    
+    Returns
+    -------
+        A dataframe with the columns of the table, in table order, and the index left out.
+    '''
+    
+    if table.name == 'orders_table':
+        df = df.reset_index()
+    
+    if table.name == 'dim_products':
+        df = df.rename(columns={'removed': 'still_available'})
+        df['still_available'] = df['still_available'].isin(STILL_AVAILABLE_VALUES)
+        df['weight_class'] = weight_class(df['weight_kg'])
+    
+    columns = [column.name for column in table.columns if column.name in df.columns]
+    
+    return df[columns]
@@ -0,0 +1,296 @@
+import numpy as np
+import pandas as pd
+
+ALPHANUMERIC = np.frombuffer(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789', dtype='u1')
+DATE_FORMATS = ['%Y-%m-%d', '%Y %B %d', '%Y/%m/%d', '%B %Y %d']
+FIRST_NAMES = ['Sigfried', 'Guy', 'Harry', 'Darren', 'Garry', 'Emma', 'Sophie', 'Laura', 'Jens', 'Anna', 'John', 'Mary']
+LAST_NAMES = ['Noack', 'Allen', 'Lawrence', 'Hussain', 'Stone', 'Wright', 'Schmidt', 'Smith', 'Brown', 'Meyer']
+COMPANIES = ['Heydrich Junitz KG', 'Robinson-Harper', 'Johnson Inc', 'Mitchell LLC', 'Weber GmbH']
+CITIES = ['London', 'High Wycombe', 'Berlin', 'Hamburg', 'New York', 'Chapletown', 'Belper', 'Miami']
+COUNTRIES = {'GB': 'United Kingdom', 'DE': 'Germany', 'US': 'United States'}
+PHONE_FORMATS = {'GB': ['+44(0)20 {a}{b}', '(0161) {a}{b}', '0{a}.{b}'], 'DE': ['+49(0){a} {b}', '0{a}-{b}'],
+                 'US': ['+1-{a}-{b}', '({a}) {b}', '001-{a}-{b}']}
+CARD_PROVIDERS = ['VISA 16 digit', 'VISA 19 digit', 'Mastercard', 'American Express', 'Diners Club / Carte Blanche',
+                  'JCB 15 digit', 'JCB 16 digit', 'Discover', 'Maestro', 'VISA 13 digit']
+STORE_TYPES = ['Local', 'Super Store', 'Mall Kiosk', 'Outlet']
+CONTINENTS = {'GB': 'Europe', 'DE': 'Europe', 'US': 'America'}
+CATEGORIES = ['toys-and-games', 'sports-and-leisure', 'pets', 'homeware', 'health-and-beauty', 'food-and-drink', 'diy']
+WEIGHTS = ['1.6kg', '0.45kg', '500g', '77g .', '330ml', '1.2kg', '16oz', '12 x 100g', '3 x 2kg', '90g']
+TIME_PERIODS = ['Late_Hours', 'Morning', 'Midday', 'Evening']
+
+class SyntheticDataGenerator:
+    
+    def __init__(self, seed=0, null_fraction=0.002, junk_fraction=0.002):
+        
+        '''It sets up a deterministic generator of dirty dataframes that look like each of the sources of the
+        pipeline, with the same quirks the cleaners have to deal with
+        
+        Parameters
+        ----------
+        seed
+            the seed of the random number generator, so the same seed always gives the same data
+        null_fraction
+            the fraction of rows made entirely of 'NULL' strings
+        junk_fraction
+            the fraction of rows made entirely of random uppercase strings
+        '''
+        
+        self.seed = seed
+        self.null_fraction = null_fraction
+        self.junk_fraction = junk_fraction
+        self.rng = np.random.default_rng(seed)
+    
+    
+    
+    def choice(self, values, n):
+        
+        '''This function picks n values at random from a list, returning an object array'''
+        
+        return self.rng.choice(np.asarray(values, dtype=object), n)
+    
+    
+    
+    def junk(self, n, length=10):
+        
+        '''This function returns n random strings of uppercase letters and digits, like the junk rows of the
+        sources'''
+        
+        codes = self.rng.integers(0, len(ALPHANUMERIC), size=(n, length))
+        
+        return ALPHANUMERIC[codes].view(f'S{length}').ravel().astype(str).astype(object)
+    
+    
+    
+    def digits(self, n, width):
+        
+        '''This function returns n random strings of exactly width digits'''
+        
+        chunks = []
+        while width > 0:
+            part = min(width, 18)
+            chunks.append(pd.Series(self.rng.integers(0, 10 ** part, n)).astype(str).str.zfill(part))
+            width -= part
+        
+        return pd.concat(chunks, axis=1).sum(axis=1).to_numpy(dtype=object) if len(chunks) > 1 else chunks[0].to_numpy(dtype=object)
+    
+    
+    
+    def uuids(self, n):
+        
+        '''This function returns n random UUID strings'''
+        
+        high = pd.Series(self.rng.integers(0, 2 ** 63, n, dtype=np.int64)).map('{:016x}'.format)
+        low = pd.Series(self.rng.integers(0, 2 ** 63, n, dtype=np.int64)).map('{:016x}'.format)
+        uuids = high.str[:8] + '-' + high.str[8:12] + '-4' + high.str[13:16] + '-a' + low.str[1:4] + '-' + low.str[4:16]
+        
+        return uuids.to_numpy(dtype=object)
+    
+    
+    
+    def dates(self, n, start, end, mixed=True):
+        
+        '''This function returns n random dates between start and end as strings, written in one of the
+        formats found in the sources when mixed is True and as ISO dates otherwise'''
+        
+        days = self.rng.integers(0, (pd.Timestamp(end) - pd.Timestamp(start)).days, n)
+        dates = pd.Timestamp(start) + pd.to_timedelta(days, unit='D')
+        if not mixed:
+            return dates.strftime(DATE_FORMATS[0]).to_numpy(dtype=object)
+        
+        formats = self.rng.choice(len(DATE_FORMATS), n, p=[0.85, 0.05, 0.05, 0.05])
+        strings = np.empty(n, dtype=object)
+        for position, date_format in enumerate(DATE_FORMATS):
+            rows = formats == position
+            strings[rows] = dates[rows].strftime(date_format)
+        
+        return strings
+    
+    
+    
+    def dirty_rows(self, df):
+        
+        '''This function turns a random fraction of the rows of a dataframe into 'NULL' rows and another
+        fraction into junk rows, in place'''
+        
+        n = len(df)
+        kinds = self.rng.random(n)
+        null_rows = kinds < self.null_fraction
+        junk_rows = (kinds >= self.null_fraction) & (kinds < self.null_fraction + self.junk_fraction)
+        number_of_junk_rows = int(junk_rows.sum())
+        
+        for column in df.columns:
+            if df[column].dtype != object:
+                df[column] = df[column].astype(object)
+            df.loc[null_rows, column] = 'NULL'
+            if number_of_junk_rows:
+                df.loc[junk_rows, column] = self.junk(number_of_junk_rows)
+        
+        return df
+    
+    
+    
+    def users(self, n):
+        
+        '''This function returns n rows that look like the legacy_users table, with '@@' in some email
+        addresses, 'GGB' country codes and phone numbers in many formats'''
+        
+        country_code = self.choice(list(COUNTRIES), n)
+        first_name = self.choice(FIRST_NAMES, n)
+        last_name = self.choice(LAST_NAMES, n)
+        separators = np.where(self.rng.random(n) < 0.05, '@@', '@').astype(object)
+        phone_a = self.digits(n, 3)
+        phone_b = self.digits(n, 7)
+        phone_number = np.empty(n, dtype=object)
+        for code, formats in PHONE_FORMATS.items():
+            rows = np.flatnonzero(country_code == code)
+            picked = self.rng.integers(0, len(formats), len(rows))
+            phone_number[rows] = [formats[k].format(a=a, b=b) for k, a, b in zip(picked, phone_a[rows], phone_b[rows])]
+        
+        df = pd.DataFrame({
+            'first_name': first_name,
+            'last_name': last_name,
+            'date_of_birth': self.dates(n, '1940-01-01', '2006-01-01'),
+            'company': self.choice(COMPANIES, n),
+            'email_address': first_name + '.' + last_name + separators + 'example.com',
+            'address': self.choice(CITIES, n),
+            'country': pd.Series(country_code).map(COUNTRIES).to_numpy(dtype=object),
+            'country_code': np.where(self.rng.random(n) < 0.02, 'GGB', country_code).astype(object),
+            'phone_number': phone_number,
+            'join_date': self.dates(n, '1992-01-01', '2022-06-01'),
+            'user_uuid': self.uuids(n),
+        }, index=pd.RangeIndex(n, name='index'))
+        
+        return self.dirty_rows(df)
+    
+    
+    
+    def cards(self, n):
+        
+        '''This function returns n rows that look like the parsed card_details.pdf, with some card numbers
+        prefixed with '?' characters'''
+        
+        card_number = self.digits(n, 16)
+        question_marks = self.rng.random(n) < 0.01
+        card_number[question_marks] = '???' + card_number[question_marks]
+        expiry_month = pd.Series(self.rng.integers(1, 13, n)).astype(str).str.zfill(2)
+        expiry_year = pd.Series(self.rng.integers(22, 32, n)).astype(str)
+        
+        df = pd.DataFrame({
+            'card_number': card_number,
+            'expiry_date': (expiry_month + '/' + expiry_year).to_numpy(dtype=object),
+            'card_provider': self.choice(CARD_PROVIDERS, n),
+            'date_payment_confirmed': self.dates(n, '1990-01-01', '2022-12-31'),
+        })
+        
+        return self.dirty_rows(df)
+    
+    
+    
+    def stores(self, n):
+        
+        '''This function returns n rows that look like the store details API responses, with a mostly empty
+        lat column, letters in some staff numbers and continents prefixed with 'ee' '''
+        
+        country_code = self.choice(list(CONTINENTS), n)
+        continent = pd.Series(country_code).map(CONTINENTS)
+        continent = np.where(self.rng.random(n) < 0.02, 'ee' + continent, continent).astype(object)
+        staff_numbers = pd.Series(self.rng.integers(5, 100, n)).astype(str).to_numpy(dtype=object)
+        lettered = self.rng.random(n) < 0.01
+        staff_numbers[lettered] = 'J' + staff_numbers[lettered]
+        
+        df = pd.DataFrame({
+            'address': self.choice(CITIES, n),
+            'longitude': pd.Series(self.rng.uniform(-10, 15, n)).round(5).astype(str).to_numpy(dtype=object),
+            'lat': np.full(n, None, dtype=object),
+            'locality': self.choice(CITIES, n),
+            'store_code': (self.junk(n, 2) + '-' + self.digits(n, 8)).astype(object),
+            'staff_numbers': staff_numbers,
+            'opening_date': self.dates(n, '1990-01-01', '2022-06-01'),
+            'store_type': self.choice(STORE_TYPES, n),
+            'latitude': pd.Series(self.rng.uniform(40, 60, n)).round(5).astype(str).to_numpy(dtype=object),
+            'country_code': country_code,
+            'continent': continent,
+        })
+        df = self.dirty_rows(df)
+        df['lat'] = None
+        
+        return df
+    
+    
+    
+    def products(self, n):
+        
+        '''This function returns n rows that look like products.csv, with weights in mixed units and
+        multipacks, prices written with a £ sign and some EANs that are too long'''
+        
+        ean = self.digits(n, 13)
+        too_long = self.rng.random(n) < 0.01
+        ean[too_long] = ean[too_long] + '0'
+        
+        df = pd.DataFrame({
+            'Unnamed: 0': np.arange(n),
+            'product_name': self.choice(FIRST_NAMES, n) + ' ' + self.choice(CATEGORIES, n),
+            'product_price': '£' + pd.Series(self.rng.integers(100, 100000, n) / 100).map('{:.2f}'.format).to_numpy(dtype=object),
+            'weight': self.choice(WEIGHTS, n),
+            'category': self.choice(CATEGORIES, n),
+            'EAN': ean,
+            'date_added': self.dates(n, '1990-01-01', '2022-06-01'),
+            'uuid': self.uuids(n),
+            'removed': self.choice(['Still_avaliable', 'Removed'], n),
+            'product_code': (self.junk(n, 2) + '-' + self.digits(n, 7)).astype(object),
+        })
+        unnamed = df.pop('Unnamed: 0')
+        df = self.dirty_rows(df)
+        df.insert(0, 'Unnamed: 0', unnamed)
+        
+        return df
+    
+    
+    
+    def date_times(self, n):
+        
+        '''This function returns n rows that look like date_details.json, with junk and 'NULL' rows'''
+        
+        seconds = pd.Series(self.rng.integers(0, 86400, n))
+        hours = seconds // 3600
+        
+        df = pd.DataFrame({
+            'timestamp': pd.to_datetime(seconds, unit='s').dt.strftime('%H:%M:%S').to_numpy(dtype=object),
+            'month': pd.Series(self.rng.integers(1, 13, n)).astype(str).to_numpy(dtype=object),
+            'year': pd.Series(self.rng.integers(1992, 2023, n)).astype(str).to_numpy(dtype=object),
+            'day': pd.Series(self.rng.integers(1, 29, n)).astype(str).to_numpy(dtype=object),
+            'time_period': np.asarray(TIME_PERIODS, dtype=object)[np.digitize(hours, [6, 12, 18]) % 4],
+            'date_uuid': self.uuids(n),
+        })
+        df.index = df.index.astype(str)
+        
+        return self.dirty_rows(df)
+    
+    
+    
+    def orders(self, n, users=None, stores=None, products=None):
+        
+        '''This function returns n rows that look like the orders_table, with the personal columns the
+        cleaner drops, taking its keys from the given users, stores and products dataframes when they are
+        passed so that most orders refer to rows that exist'''
+        
+        user_uuid = self.choice(users['user_uuid'], n) if users is not None else self.uuids(n)
+        store_code = self.choice(stores['store_code'], n) if stores is not None else self.junk(n, 2) + '-' + self.digits(n, 8)
+        product_code = self.choice(products['product_code'], n) if products is not None else self.junk(n, 2) + '-' + self.digits(n, 7)
+        web = self.rng.random(n) < 0.25
+        store_code = np.where(web, 'WEB-1388012W', store_code).astype(object)
+        
+        df = pd.DataFrame({
+            'level_0': np.arange(n),
+            'date_uuid': self.uuids(n),
+            'first_name': np.full(n, None, dtype=object),
+            'last_name': np.full(n, None, dtype=object),
+            'user_uuid': user_uuid,
+            'card_number': self.digits(n, 16),
+            'store_code': store_code,
+            'product_code': product_code,
+            '1': np.full(n, np.nan),
+            'product_quantity': self.rng.integers(1, 14, n),
+        }, index=pd.RangeIndex(n, name='index'))
+        
+        return df
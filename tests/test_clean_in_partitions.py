@@ -0,0 +1,35 @@
+import pytest
+from pandas.testing import assert_frame_equal
+from data_cleaning import DataCleaner, MIN_PARTITION_ROWS
+from synthetic_data import SyntheticDataGenerator
+
+CLEANERS = [('clean_user_data', 'users'), ('clean_card_data', 'cards'), ('clean_store_data', 'stores'),
+            ('clean_products_data', 'products'), ('clean_orders_data', 'orders'), ('clean_date_times_data', 'date_times')]
+
+@pytest.fixture(scope='module')
+def partitioned_cleaner():
+    with DataCleaner(max_workers=2) as cleaner:
+        yield cleaner
+
+
+
+@pytest.mark.parametrize('method, source', CLEANERS)
+def test_partitioned_cleaning_matches_serial_cleaning(partitioned_cleaner, method, source):
+    df = getattr(SyntheticDataGenerator(seed=2), source)(2 * MIN_PARTITION_ROWS + 100)
+    
+    serial = getattr(DataCleaner(), method)(df.copy())
+    partitioned = partitioned_cleaner.clean_in_partitions(method, df.copy())
+    
+    assert_frame_equal(partitioned, serial, check_index_type=True, check_column_type=True)
+
+
+
+def test_partitioned_cleaning_merges_unparseable_counts(partitioned_cleaner):
+    df = SyntheticDataGenerator(seed=2).users(2 * MIN_PARTITION_ROWS + 100)
+    serial_cleaner = DataCleaner()
+    
+    serial_cleaner.clean_user_data(df.copy())
+    partitioned_cleaner.date_parser.unparseable = {}
+    partitioned_cleaner.clean_in_partitions('clean_user_data', df.copy())
+    
+    assert partitioned_cleaner.date_parser.unparseable == serial_cleaner.date_parser.unparseable
@@ -0,0 +1,47 @@
+import pandas as pd
+from data_cleaning import DataCleaner
+
+def make_users(phone_numbers, country_codes):
+    
+    '''This function returns a legacy_users frame with one clean row per phone number'''
+    
+    n = len(phone_numbers)
+    
+    return pd.DataFrame({'first_name': ['Ann'] * n, 'last_name': ['Lee'] * n,
+                         'date_of_birth': ['1990-01-0' + str(1 + i % 9) for i in range(n)],
+                         'company': ['Acme'] * n, 'email_address': [f'user{i}@example.com' for i in range(n)],
+                         'address': ['1 High Street'] * n, 'country': ['United Kingdom'] * n,
+                         'country_code': country_codes, 'phone_number': phone_numbers,
+                         'join_date': ['2020-05-0' + str(1 + i % 9) for i in range(n)],
+                         'user_uuid': [f'uuid-{i}' for i in range(n)]})
+
+
+
+def old_prefix(user_df):
+    
+    '''This function prefixes the phone numbers the way clean_user_data did before it was vectorized,
+    looking up the country code of each phone number with a scan of the whole column'''
+    
+    code_dict = {'GB': '0044', 'US': '001', 'DE': '0049'}
+    
+    return user_df['phone_number'].apply(lambda x: code_dict.get(user_df.loc[user_df['phone_number']==x, 'country_code'].values[0], '') + x)
+
+
+
+def test_prefix_matches_old_implementation_on_unique_phone_numbers():
+    user_df = make_users(['7700900123', '2025550143', '3012345678', '5550100'], ['GB', 'US', 'DE', 'FR'])
+    
+    clean_df = DataCleaner().clean_user_data(user_df.copy())
+    
+    assert clean_df['phone_number'].tolist() == old_prefix(user_df).tolist()
+    assert clean_df['phone_number'].tolist() == ['00447700900123', '0012025550143', '00493012345678', '5550100']
+
+
+
+def test_prefix_follows_each_row_when_phone_numbers_are_shared():
+    user_df = make_users(['7700900123', '7700900123', '3012345678'], ['GB', 'US', 'DE'])
+    
+    clean_df = DataCleaner().clean_user_data(user_df.copy())
+    
+    assert clean_df['phone_number'].tolist() == ['00447700900123', '0017700900123', '00493012345678']
+    assert old_prefix(user_df).tolist()[1] == '00447700900123'
@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+from cleaning_plan import CleaningPlan
+from data_cleaning import DataCleaner
+from date_parser import DateParser
+from synthetic_data import SyntheticDataGenerator
+
+CLEANERS = [('clean_user_data', 'users'), ('clean_card_data', 'cards'), ('clean_store_data', 'stores'),
+            ('clean_products_data', 'products'), ('clean_orders_data', 'orders'), ('clean_date_times_data', 'date_times')]
+
+@pytest.mark.parametrize('method, source', CLEANERS)
+def test_optimised_plan_matches_steps_in_recorded_order(monkeypatch, method, source):
+    df = getattr(SyntheticDataGenerator(seed=1), source)(3000)
+    
+    optimised = getattr(DataCleaner(), method)(df.copy())
+    monkeypatch.setattr(CleaningPlan, 'optimise', lambda plan: list(plan.steps))
+    unoptimised = getattr(DataCleaner(), method)(df.copy())
+    
+    assert_frame_equal(optimised, unoptimised)
+
+
+
+def test_filter_does_not_move_ahead_of_non_rowwise_steps():
+    plans = [CleaningPlan().reset_index().reject('a', 'x'),
+             CleaningPlan().cast('b', 'category').reject('a', 'x'),
+             CleaningPlan().to_datetime('b').reject('a', 'x')]
+    
+    for plan in plans:
+        assert [step.kind for step in plan.optimise()] == ['transform', 'filter']
+
+
+
+def test_filter_does_not_move_ahead_of_a_step_writing_its_column():
+    plans = [CleaningPlan().assign('a', lambda df: df['a'].str.upper()).reject('a', 'x'),
+             CleaningPlan().replace('a', 'y', 'x').keep('a', lambda values: values.str.len() < 3),
+             CleaningPlan().rename({'b': 'a'}).reject('a', 'x')]
+    
+    for plan in plans:
+        assert [step.kind for step in plan.optimise()] == ['transform', 'filter']
+    
+    plan = CleaningPlan().replace('a', 'y', 'x').drop_nulls()
+    assert plan.optimise() == plan.steps
+
+
+
+def test_filter_moves_ahead_of_rowwise_steps_on_other_columns():
+    plan = (CleaningPlan()
+            .replace('b', 'y', 'x')
+            .to_datetime('c', DateParser())
+            .cast('d', 'float')
+            .reject('a', 'x'))
+    
+    steps = plan.optimise()
+    
+    assert steps[0] is plan.steps[3]
+    assert [step.kind for step in steps] == ['filter', 'transform', 'transform', 'transform']
+
+
+
+def test_moved_filters_keep_their_order():
+    plan = CleaningPlan().replace('b', 'y', 'x').reject('a', 'x').keep('c', lambda values: values.notna())
+    
+    steps = plan.optimise()
+    
+    assert steps == [plan.steps[1], plan.steps[2], plan.steps[0]]
+    df = pd.DataFrame({'a': ['x', 'ok', 'ok'], 'b': ['y', 'y', 'z'], 'c': [1, None, 2]})
+    assert_frame_equal(plan.execute(df.copy()), pd.DataFrame({'a': ['ok'], 'b': ['z'], 'c': [2.0]}, index=[2]))
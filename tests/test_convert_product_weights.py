@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+from data_cleaning import DataCleaner
+
+def convert(values):
+    
+    '''This function converts a list of weights with a new cleaner and returns the weights in kg and the
+    cleaner'''
+    
+    cleaner = DataCleaner()
+    
+    return cleaner.convert_product_weights(pd.Series(values, name='weight')).tolist(), cleaner
+
+
+
+def test_units_are_converted_to_kg():
+    weights, cleaner = convert(['1.6kg', '500g', '330ml', '16oz', '.5kg'])
+    
+    np.testing.assert_allclose(weights, [1.6, 0.5, 0.33, 16 * 0.0283495, 0.5])
+    assert cleaner.unparseable_weights == 0
+
+
+
+def test_multipacks_are_multiplied_out():
+    weights, _ = convert(['3 x 2kg', '12 x 100g', '2x 330ml'])
+    
+    np.testing.assert_allclose(weights, [6, 1.2, 0.66])
+
+
+
+def test_uppercase_and_stray_spaces_are_accepted():
+    weights, _ = convert(['2KG', ' 500 G', '100g .', '77g .', '1 Kg'])
+    
+    np.testing.assert_allclose(weights, [2, 0.5, 0.1, 0.077, 1])
+
+
+
+def test_garbage_values_become_nan_and_are_counted():
+    weights, cleaner = convert(['9GO9NZ5JTL', '1kg', 'ten grams', '9GO9NZ5JTL', None])
+    
+    assert weights[1] == 1
+    assert np.isnan([weights[0], weights[2], weights[3], weights[4]]).all()
+    assert cleaner.unparseable_weights == 3